@@ -1,10 +1,9 @@
-from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+from intent_classifier import classify, record, LABELS
+from llm_clients import get_chat_model
+from conversation_memory import memory_context
 
-def router(state):
-    llm = ChatOpenAI(model="gpt-4o-mini")
-    prompt = PromptTemplate.from_template("""
+ROUTER_PROMPT = PromptTemplate.from_template("""
     You are an intelligent router for a life insurance conversation. Analyze the user's input to determine their primary intent. Consider the following categories:
 
     1. General Interest (sales_agent): The user is in the early stages of inquiry, seeking general information, or engaging in friendly conversation about life insurance.
@@ -12,6 +11,9 @@ def router(state):
     3. Purchase Intent (needs_agent): The user is expressing a clear intent to buy insurance, is ready for a needs assessment, or is asking about the process of buying an insurance product.
     4. Specific Recommendations (recommendation_agent): The user wants personalized product recommendations or is following up on previous recommendations.
 
+    Conversation so far:
+    {history}
+
     Current User Input: {input}
 
     Analyze the input carefully, considering both explicit and implicit indications of the user's intent. If unsure, default to the sales_agent for further exploration of the user's needs.
@@ -20,17 +22,8 @@ def router(state):
 
     Your answer:
     """)
-    chain = prompt | llm
-    response = chain.invoke({"input": state["input"]})
-    decision = response.content.strip().lower()
-    print(f"Decision made: {decision}")
-    return {"decision": decision, "input": state["input"]}
 
-def sales_agent(state):
-    print("Using sales agent")
-    llm = ChatOpenAI(model="gpt-4o-mini")
-    
-    prompt = PromptTemplate.from_template(
+SALES_PROMPT = PromptTemplate.from_template(
      """You are a friendly and empathetic life insurance sales agent. Your primary goal is to engage in a warm conversation with the customer and determine if they want to buy life insurance or learn more about it. In 50 words your approach should be:
 
         1. Build rapport and make the customer feel comfortable. Keep your conversation short.
@@ -41,16 +34,52 @@ def sales_agent(state):
         Be natural, patient, and avoid being pushy. Your responses should be conversational and always end by asking if the customer wants to buy life insurance or learn more about it.
         Maintain a friendly tone and end by asking if they want to buy life insurance or learn more about it.
         
+        Conversation so far:
+        {history}
+
         User: {input}
 
         Your response (ask questions warmly and explain their importance):
         """
-    )
-    
-    chain = LLMChain(llm=llm, prompt=prompt)
-    response = chain.invoke({"input": state["input"]})
-    
-    return {"output": response["text"]}
+)
+
+router_chain = ROUTER_PROMPT | get_chat_model("gpt-4o-mini")
+sales_chain = SALES_PROMPT | get_chat_model("gpt-4o-mini", streaming=True)
+
+def route(decision, state):
+    # UI flags are per turn; clear the ones a previous turn left in the checkpointed state
+    return {
+        "decision": decision,
+        "decisions": [decision],
+        "input": state["input"],
+        "show_form": False,
+        "show_contact_form": False,
+        # Questionnaire prompts only belong to the turns that ask them
+        "current_question": None,
+        "progress": None,
+        "recommendation_job": None
+    }
+
+def router(state):
+    # Obvious cases are routed locally; the LLM prompt below handles the rest
+    decision, confidence, method = classify(state["input"])
+    if decision:
+        skip_rate = record(method)
+        print(f"Decision made: {decision} ({method}, confidence {confidence:.2f}, LLM skipped for {skip_rate:.0%} of turns)")
+        return route(decision, state)
+
+    response = router_chain.invoke({"input": state["input"], "history": memory_context(state.get("memory"), "router")})
+    decision = response.content.strip().strip('"').lower()
+    if decision not in LABELS:
+        decision = "sales_agent"
+    skip_rate = record("llm")
+    print(f"Decision made: {decision} (llm, local confidence {confidence:.2f}, LLM skipped for {skip_rate:.0%} of turns)")
+    return route(decision, state)
+
+def sales_agent(state):
+    print("Using sales agent")
+    response = sales_chain.invoke({"input": state["input"], "history": memory_context(state.get("memory"), "sales_agent")})
+    return {"output": response.content}
 
 def needs_agent(state):
     print("Using needs agent")
@@ -0,0 +1,97 @@
+import os
+import json
+import httpx
+from dotenv import load_dotenv
+from job_queue import QueueFullError
+from booking_store import BookingLimitError
+
+load_dotenv()
+
+# When set, the Streamlit apps send turns to the HTTP service (server.py) instead of running the graph in-process
+CHATBOT_API_URL = os.getenv("CHATBOT_API_URL", "").rstrip("/")
+CHATBOT_API_TIMEOUT = float(os.getenv("CHATBOT_API_TIMEOUT", "300"))
+
+class SSEStream:
+    """Iterate over the 'token' events of a server-sent event response; the 'done' payload is in .result afterwards"""
+
+    def __init__(self, path, payload):
+        self.url = CHATBOT_API_URL + path
+        self.payload = payload
+        self.result = None
+
+    def __iter__(self):
+        with httpx.stream("POST", self.url, json=self.payload, timeout=CHATBOT_API_TIMEOUT) as response:
+            response.raise_for_status()
+            event, data = None, []
+            for line in response.iter_lines():
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data.append(line[len("data:"):].strip())
+                elif not line and event:
+                    payload = json.loads("\n".join(data))
+                    if event == "token":
+                        yield payload["token"]
+                    elif event == "done":
+                        self.result = payload
+                    elif event == "error":
+                        raise RuntimeError(payload["error"])
+                    event, data = None, []
+
+def stream_chat(thread_id, message):
+    return SSEStream("/chat/stream", {"thread_id": thread_id, "message": message})
+
+def submit_recommendations(thread_id, form_data, language="en"):
+    """
+    Start generating quick-form recommendations on the service.
+
+    Raises:
+        QueueFullError: The service's job queue is full
+
+    Returns:
+        str: Id of the job to poll with job_status
+    """
+    response = httpx.post(
+        CHATBOT_API_URL + "/recommendations/jobs",
+        json={"thread_id": thread_id, "language": language, **form_data},
+        timeout=CHATBOT_API_TIMEOUT,
+    )
+    if response.status_code == 503:
+        raise QueueFullError(response.json().get("detail", "The service is busy"))
+    response.raise_for_status()
+    return response.json()["job_id"]
+
+def job_status(job_id):
+    """Status of a background job (see job_queue.JobQueue.status); None when unknown or expired"""
+    response = httpx.get(f"{CHATBOT_API_URL}/jobs/{job_id}", timeout=CHATBOT_API_TIMEOUT)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+def available_slots():
+    """Free consultation slots as {date: [times]}"""
+    response = httpx.get(CHATBOT_API_URL + "/slots", timeout=CHATBOT_API_TIMEOUT)
+    response.raise_for_status()
+    return response.json()["slots"]
+
+def book_slot(thread_id, date, time, phone, notes=""):
+    """
+    Book a consultation slot; returns None when the slot is no longer available.
+
+    Raises:
+        BookingLimitError: The phone number or conversation has too many upcoming bookings
+    """
+    response = httpx.post(
+        CHATBOT_API_URL + "/bookings",
+        json={"thread_id": thread_id, "date": date, "time": time, "phone": phone, "notes": notes},
+        timeout=CHATBOT_API_TIMEOUT,
+    )
+    if response.status_code == 409:
+        return None
+    if response.status_code == 429:
+        raise BookingLimitError(response.json()["detail"])
+    response.raise_for_status()
+    return response.json()["booking_id"]
+
+__all__ = ['CHATBOT_API_URL', 'stream_chat', 'submit_recommendations', 'job_status', 'available_slots', 'book_slot']
@@ -1,14 +1,16 @@
 import os
+import uuid
 import streamlit as st
 import streamlit.components.v1 as components
 from typing import TypedDict
-from datetime import datetime, timedelta
-from graph import create_graph
+from datetime import datetime
+from graph import get_graph, thread_config, submit_recommendations
 from dotenv import load_dotenv
-# from needs_agent import needs_agent
-from langchain.chains import LLMChain
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
+from job_queue import get_job_queue, QueueFullError, DONE, FAILED
+from streaming import GraphStream
+from chat_history import get_chat_history_store, CHAT_HISTORY_WINDOW, CHAT_HISTORY_PAGE_SIZE
+from booking_store import get_booking_store, SlotUnavailableError, BookingLimitError
+import api_client
 
 # Load environment variables
 load_dotenv()
@@ -18,6 +20,9 @@ if not os.getenv('OPENAI_API_KEY'):
     st.error("Please set the OPENAI_API_KEY environment variable.")
     st.stop()
 
+# How often the page checks on recommendations being generated in the job queue
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+
 class ChatState(TypedDict):
     input: str
     output: str
@@ -115,12 +120,23 @@ def inject_custom_css():
         </style>
     """, unsafe_allow_html=True)
 
+def add_messages(*messages):
+    """Store messages for this conversation, keeping only the recent window in session state"""
+    stored = get_chat_history_store().append(st.session_state.thread_id, list(messages))
+    st.session_state.messages = (st.session_state.messages + stored)[-CHAT_HISTORY_WINDOW:]
+    st.session_state.last_message_id = stored[-1]["id"]
+
 def initialize_session_state():
     """Initialize all session state variables"""
+    if "thread_id" not in st.session_state:
+        st.session_state.thread_id = str(uuid.uuid4())
     if "messages" not in st.session_state:
-        st.session_state.messages = [
+        # Only the recent window lives in session state; the full transcript is in the history store
+        st.session_state.messages = []
+        st.session_state.history_pages = 0
+        add_messages(
             {"role": "assistant", "content": "Xin chào! Tôi là trợ lý AI của bạn. Xin vui lòng cho tôi biết cách xưng hô với bạn:"}
-        ]
+        )
     if "setup_complete" not in st.session_state:
         st.session_state.setup_complete = False
     if "agents" not in st.session_state:
@@ -133,100 +149,8 @@ def initialize_session_state():
         st.session_state.appointments = []
     if "user_data" not in st.session_state:
         st.session_state.user_data = {}
-
-def recommendation_agent(form_data):
-    """
-    Generate personalized insurance recommendations based on user form data.
-    
-    Args:
-        form_data (dict): Dictionary containing user form responses
-    
-    Returns:
-        dict: Contains recommendation output and UI control flags
-    """
-    
-    # Sample product information - In production, this should come from a database
-    sample_product_info = """
-    Life Insurance Products:
-    1. "An Tâm Tài Chính" (Financial Peace of Mind)
-    - Comprehensive term life insurance with full protection benefits
-    - Sum assured up to 30 times annual income
-    - Premium options: Monthly, Quarterly, Semi-annual, Annual
-    - Entry age: 18-65 years
-    
-    2. "Phúc Bảo An" (Secure Prosperity)
-    - Whole life insurance with savings component
-    - Death benefit: 100% sum assured plus accumulated bonuses
-    - Premium payment term: 10, 15, 20 years
-    - Entry age: 0-65 years
-    
-    Health Insurance Products:
-    1. "Sống Khỏe" (Healthy Living)
-    - Comprehensive critical illness coverage
-    - Covers 45 critical illnesses
-    - Lump sum payment up to 2 billion VND
-    - Premium payment term: 10-20 years
-    
-    Education Plans:
-    1. "Học Vấn Tương Lai" (Future Education)
-    - Education plan with protection benefits
-    - Guaranteed education fund
-    - Flexible premium payment terms
-    - Entry age: 0-15 years for children
-    """
-    
-    # Create the recommendation prompt
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """You are an MB Ageas Life insurance specialist. Analyze the customer profile and recommend suitable insurance products. Follow these guidelines:
-
-        1. Focus on the customer's specific life situation and needs
-        2. Recommend 2-3 most relevant products from the provided options
-        3. Explain why each recommended product suits their situation
-        4. Present all information in Vietnamese
-        5. Keep explanations clear and concise
-        6. End with a call to action to schedule a consultation
-        
-        Format your response with clear sections:
-        - Brief profile summary
-        - Product recommendations with explanations
-        - Next steps"""),
-        
-        ("human", """Customer Profile:
-        Tuổi: {age}
-        Tình trạng hôn nhân: {marital_status}
-        Có con: {has_children}
-        Số con: {num_children}
-        
-        Available Products:
-        {products}
-        
-        Please provide personalized recommendations in Vietnamese:""")
-    ])
-
-    # Create the LLM chain
-    chain = LLMChain(
-        llm=ChatOpenAI(
-            temperature=0.7,
-            model="gpt-4",
-            max_tokens=2000
-        ),
-        prompt=prompt
-    )
-
-    # Generate recommendations
-    recommendations = chain.run(
-        age=form_data["age"],
-        marital_status="Đã kết hôn" if form_data["is_married"] else "Độc thân",
-        has_children="Có" if form_data["has_children"] else "Không",
-        num_children=form_data["num_children"],
-        products=sample_product_info
-    )
-    
-    # Return recommendations with UI control flags
-    return {
-        "output": recommendations,
-        "show_contact_form": True  # Enable scheduling after recommendations
-    }
+    if "recommendation_job" not in st.session_state:
+        st.session_state.recommendation_job = None
 
 def get_user_details():
     """Collect initial user details"""
@@ -249,10 +173,10 @@ def get_user_details():
             st.session_state.user_name = name.strip()
             st.session_state.setup_complete = True
             welcome_message = f"Rất vui được gặp bạn, {title} {name}! Tôi là đại lý bảo hiểm AI. Tôi có thể giúp bạn biết thêm về bảo hiểm nhân thọ và đề xuất các sản phẩm phù hợp dựa trên nhu cầu của bạn. Hãy cho tôi biết, hôm nay tôi có thể giúp gì cho bạn?"
-            st.session_state.messages.extend([
+            add_messages(
                 {"role": "user", "content": f"Selected: {title} {name}"},
                 {"role": "assistant", "content": welcome_message}
-            ])
+            )
             st.rerun()
 
 def process_needs_form():
@@ -301,47 +225,75 @@ def process_needs_form():
             st.session_state.form_submitted = True
             st.session_state.form_data = form_data
             
-            # Generate recommendations
-            recommendations = recommendation_agent(form_data)
-            
-            # Add recommendations to chat history
-            st.session_state.messages.extend([
-                {"role": "assistant", "content": "Dựa trên hồ sơ của bạn, đây là những đề xuất được cá nhân hóa của tôi:"},
-                {"role": "assistant", "content": recommendations["output"]}
-            ])
-            
-            # Show contact form if recommended
-            if recommendations.get("show_contact_form", False):
-                st.session_state.show_contact_form = True
+            # Generated in the job queue (in-process or on the service), not in this script run;
+            # display_recommendation_job picks up the result
+            try:
+                if api_client.CHATBOT_API_URL:
+                    job_id = api_client.submit_recommendations(st.session_state.thread_id, form_data, "vi")
+                else:
+                    job_id = submit_recommendations(st.session_state.thread_id, form_data, "vi").id
+            except QueueFullError:
+                st.session_state.form_submitted = False
+                st.error("Xin lỗi, hệ thống đang xử lý nhiều yêu cầu. Vui lòng thử lại sau vài phút.")
+                return
+            st.session_state.recommendation_job = job_id
+            add_messages({"role": "assistant", "content": "Dựa trên hồ sơ của bạn, đây là những đề xuất được cá nhân hóa của tôi:"})
             
             st.session_state.agents.append("recommendation_agent")
             st.rerun()
 
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def display_recommendation_job():
+    """Show the progress of the pending recommendation job and add its answer to the chat once it is done"""
+    job_id = st.session_state.recommendation_job
+    job = api_client.job_status(job_id) if api_client.CHATBOT_API_URL else get_job_queue().status(job_id)
+    if job is None or job["status"] == FAILED:
+        st.session_state.recommendation_job = None
+        add_messages({"role": "assistant", "content": "Xin lỗi, không thể tạo đề xuất. Vui lòng thử lại sau."})
+        st.rerun()
+    elif job["status"] == DONE:
+        st.session_state.recommendation_job = None
+        add_messages({"role": "assistant", "content": job["result"]["output"]})
+        if job["result"].get("show_contact_form"):
+            st.session_state.show_contact_form = True
+        st.rerun()
+    else:
+        with st.chat_message("assistant"):
+            if job["partial"]:
+                st.markdown(job["partial"])
+            else:
+                st.markdown("Đang chuẩn bị đề xuất cho bạn...")
+                if job["position"]:
+                    st.caption(f"Còn {job['position']} yêu cầu trước bạn")
+
 def render_contact_calendar_form():
     """Render the contact and calendar scheduling form"""
+    st.write("### Đặt lịch tư vấn")
+
+    # Free slots come from the shared booking store, so slots taken in other sessions never show up
+    slots = api_client.available_slots() if api_client.CHATBOT_API_URL else get_booking_store().available_slots()
+    if not slots:
+        st.warning("Hiện không còn lịch tư vấn trống. Vui lòng thử lại sau.")
+        return False
+    dates = [datetime.strptime(day, "%Y-%m-%d").date() for day in slots]
+
+    # The date is picked outside the form so the time options follow it
+    selected_date = st.date_input(
+        "Ngày ưa thích",
+        min_value=dates[0],
+        max_value=dates[-1],
+        value=dates[0]
+    )
+
     with st.form("contact_calendar"):
-        st.write("### Đặt lịch tư vấn")
-        
         col1, col2 = st.columns(2)
-        
+
         with col1:
-            # Date selection
-            min_date = datetime.now().date()
-            max_date = min_date + timedelta(days=30)
-            selected_date = st.date_input(
-                "Ngày ưa thích",
-                min_value=min_date,
-                max_value=max_date,
-                value=min_date
-            )
-        
+            phone = st.text_input("Số điện thoại", value=st.session_state.get("form_data", {}).get("phone", ""))
+
         with col2:
             # Time selection
-            time_slots = []
-            for hour in range(9, 18):  # 9 AM to 5 PM
-                time_slots.extend([f"{hour:02d}:00", f"{hour:02d}:30"])
-            
-            selected_time = st.selectbox("Thời gian ưa thích", time_slots)
+            selected_time = st.selectbox("Thời gian ưa thích", slots.get(selected_date.isoformat(), []))
         
         st.markdown("### Ghi chú bổ sung")
         notes = st.text_area("Bất kỳ câu hỏi hoặc mối quan tâm cụ thể nào?", 
@@ -352,9 +304,28 @@ def render_contact_calendar_form():
             submitted = st.form_submit_button("Lên lịch cuộc gọi")
         
         if submitted:
-            if selected_date and selected_time:
+            if not phone or not phone.isdigit() or len(phone) != 10:
+                st.error("Vui lòng nhập số điện thoại hợp lệ gồm 10 chữ số.")
+            elif selected_date and selected_time:
+                slot_date = selected_date.strftime("%Y-%m-%d")
+                # Reserve atomically; another customer may have taken the slot since the form was drawn
+                try:
+                    if api_client.CHATBOT_API_URL:
+                        booking_id = api_client.book_slot(st.session_state.thread_id, slot_date, selected_time, phone, notes)
+                    else:
+                        booking_id = get_booking_store().book(slot_date, selected_time, phone, notes, st.session_state.thread_id)
+                except SlotUnavailableError:
+                    booking_id = None
+                except BookingLimitError:
+                    st.error("Bạn đã có lịch tư vấn sắp tới. Chuyên viên tư vấn sẽ gọi cho bạn vào thời gian đã đặt.")
+                    return False
+                if booking_id is None:
+                    st.error("Xin lỗi, khung giờ này vừa có người đặt. Vui lòng chọn khung giờ khác.")
+                    return False
+
                 appointment = {
-                    "date": selected_date.strftime("%Y-%m-%d"),
+                    "booking_id": booking_id,
+                    "date": slot_date,
                     "time": selected_time,
                     "notes": notes
                 }
@@ -375,26 +346,59 @@ def render_contact_calendar_form():
     return False
 
 def process_user_input(user_input: str):
-    """Process user input through the conversation graph"""
-    if 'graph' not in st.session_state:
-        st.session_state.graph = create_graph()
+    """Process user input through the conversation graph, rendering the answer as it streams"""
+    if api_client.CHATBOT_API_URL:
+        # Thin client: the HTTP service runs the graph and streams the answer back
+        stream = api_client.stream_chat(st.session_state.thread_id, user_input)
+    else:
+        # One compiled graph per process; this session's state lives in the checkpointer
+        stream = GraphStream(get_graph(), {"input": user_input}, config=thread_config(st.session_state.thread_id))
+    streamed = st.write_stream(stream)
+    result = stream.result
     
-    result = st.session_state.graph.invoke({"input": user_input})
+    # Cached answers and non-LLM replies arrive without streamed tokens
+    if not streamed and result.get("output"):
+        st.markdown(result["output"])
     
     if "show_contact_form" in result and result["show_contact_form"]:
         st.session_state.show_contact_form = True
+
+    # Recommendations that were not ready within the turn are generated in the job queue
+    if result.get("recommendation_job"):
+        st.session_state.recommendation_job = result["recommendation_job"]
     
     return result
 
 def display_chat_history():
-    """Display the chat history and handle dynamic content"""
-    for message in st.session_state.messages:
+    """Display the recent chat window, earlier messages on demand, and handle dynamic content"""
+    window = st.session_state.messages
+    if window and window[0]["id"] > 1:
+        # Earlier messages are read from the history store only when asked for
+        older = []
+        if st.session_state.history_pages:
+            older = get_chat_history_store().before(
+                st.session_state.thread_id,
+                window[0]["id"],
+                st.session_state.history_pages * CHAT_HISTORY_PAGE_SIZE
+            )
+        first_id = older[0]["id"] if older else window[0]["id"]
+        if first_id > 1 and st.button(f"Xem tin nhắn trước đó ({first_id - 1})", key="history_more"):
+            st.session_state.history_pages += 1
+            st.rerun()
+        if older and st.button("Ẩn tin nhắn trước đó", key="history_hide"):
+            st.session_state.history_pages = 0
+            st.rerun()
+        for message in older:
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
+
+    for message in window:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
             
             if (message["role"] == "assistant" and 
                 st.session_state.show_contact_form and 
-                message == st.session_state.messages[-1]):
+                message["id"] == st.session_state.last_message_id):
                 render_contact_calendar_form()
 
 def display_agent_sidebar():
@@ -438,25 +442,30 @@ def main():
 
         with chat_container:
             display_chat_history()
+
+            if st.session_state.recommendation_job:
+                display_recommendation_job()
             
             if not st.session_state.setup_complete:
                 get_user_details()
             
             if (st.session_state.agents and 
-                st.session_state.agents[-1] == "needs_agent" and 
+                st.session_state.agents[-1] in ("needs_agent", "recommendation_agent") and 
                 not st.session_state.form_submitted):
                 process_needs_form()
 
         with input_container:
             if st.session_state.setup_complete:
-                prompt = st.chat_input(f"Nhập tin nhắn của bạn ở đây, {st.session_state.user_name}...")
+                prompt = st.chat_input(f"Nhập tin nhắn của bạn ở đây, {st.session_state.user_name}...",
+                                       disabled=bool(st.session_state.recommendation_job))
                 
                 if prompt:
-                    st.session_state.messages.append({"role": "user", "content": prompt})
-                    response = process_user_input(prompt)
-                    st.session_state.messages.append(
-                        {"role": "assistant", "content": response["output"]}
-                    )
+                    add_messages({"role": "user", "content": prompt})
+                    with st.chat_message("user"):
+                        st.markdown(prompt)
+                    with st.chat_message("assistant"):
+                        response = process_user_input(prompt)
+                    add_messages({"role": "assistant", "content": response["output"]})
                     st.session_state.agents.append(response["decision"])
                     st.rerun()
 
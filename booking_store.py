@@ -0,0 +1,194 @@
+import os
+import time
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+BOOKING_DB = os.getenv("BOOKING_DB", "bookings.sqlite")
+# Consultations can be booked this many days ahead, in 30-minute slots from 09:00 to 17:30
+BOOKING_WINDOW_DAYS = int(os.getenv("BOOKING_WINDOW_DAYS", "30"))
+SLOT_TIMES = [f"{hour:02d}:{minute:02d}" for hour in range(9, 18) for minute in (0, 30)]
+# Calls one slot can take, i.e. the number of representatives on duty
+SLOT_CAPACITY = int(os.getenv("SLOT_CAPACITY", "1"))
+# Upcoming bookings one phone number, and one conversation, may hold at a time
+BOOKING_MAX_ACTIVE = int(os.getenv("BOOKING_MAX_ACTIVE", "2"))
+# Seconds a booking waits for another writer's SQLite transaction before failing
+BOOKING_BUSY_TIMEOUT = float(os.getenv("BOOKING_BUSY_TIMEOUT", "30"))
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS slots (
+        slot_date TEXT NOT NULL,
+        slot_time TEXT NOT NULL,
+        capacity INTEGER NOT NULL,
+        booked INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (slot_date, slot_time)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS bookings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        slot_date TEXT NOT NULL,
+        slot_time TEXT NOT NULL,
+        phone TEXT NOT NULL,
+        notes TEXT,
+        thread_id TEXT,
+        created_at REAL NOT NULL,
+        UNIQUE (phone, slot_date, slot_time)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_bookings_slot ON bookings (slot_date, slot_time)",
+    "CREATE INDEX IF NOT EXISTS idx_bookings_phone ON bookings (phone, slot_date, slot_time)",
+    "CREATE INDEX IF NOT EXISTS idx_bookings_thread ON bookings (thread_id, slot_date, slot_time)",
+]
+
+class SlotUnavailableError(ValueError):
+    """The requested slot is full, outside the booking window or already booked by this phone number"""
+
+class BookingLimitError(ValueError):
+    """The phone number or conversation already holds BOOKING_MAX_ACTIVE upcoming bookings"""
+
+class BookingStore:
+    """
+    Consultation slots and bookings in SQLite.
+
+    Slots are keyed by date and time and carry a capacity and a booked
+    count. A booking increments the count only while it is below capacity,
+    in the same transaction as the booking row, so concurrent sessions and
+    worker processes can never overbook a slot.
+
+    Each thread has its own connection: writers are serialized by SQLite's
+    BEGIN IMMEDIATE and busy timeout, not by a Python lock, so a booking
+    waiting for the write lock does not hold up readers in other threads.
+    """
+
+    def __init__(self, path=BOOKING_DB, capacity=SLOT_CAPACITY, max_active=BOOKING_MAX_ACTIVE):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.capacity = capacity
+        self.max_active = max_active
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            conn.execute(statement)
+        self._slots_until = None
+
+    def _connection(self):
+        """This thread's connection, in autocommit mode so transactions are explicit"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BOOKING_BUSY_TIMEOUT, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def ensure_slots(self, today=None):
+        """Create the slots of the booking window that don't exist yet (once per day per process)"""
+        today = today or datetime.now().date()
+        last_day = today + timedelta(days=BOOKING_WINDOW_DAYS)
+        with self._lock:
+            if self._slots_until is not None and self._slots_until >= last_day:
+                return
+        rows = [
+            ((today + timedelta(days=offset)).isoformat(), slot_time, self.capacity)
+            for offset in range(BOOKING_WINDOW_DAYS + 1)
+            for slot_time in SLOT_TIMES
+        ]
+        # INSERT OR IGNORE makes concurrent calls harmless
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO slots (slot_date, slot_time, capacity) VALUES (?, ?, ?)", rows
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            if self._slots_until is None or self._slots_until < last_day:
+                self._slots_until = last_day
+
+    def available_slots(self, now=None):
+        """
+        Free slots in the booking window, from one range query over the slot key.
+
+        Returns:
+            dict: {"YYYY-MM-DD": ["HH:MM", ...]} in date and time order; past times of today are left out
+        """
+        now = now or datetime.now()
+        self.ensure_slots(now.date())
+        last_day = (now.date() + timedelta(days=BOOKING_WINDOW_DAYS)).isoformat()
+        rows = self._connection().execute(
+            "SELECT slot_date, slot_time FROM slots "
+            "WHERE slot_date BETWEEN ? AND ? AND booked < capacity "
+            "AND (slot_date > ? OR slot_time > ?) "
+            "ORDER BY slot_date, slot_time",
+            (now.date().isoformat(), last_day, now.date().isoformat(), now.strftime("%H:%M")),
+        ).fetchall()
+        slots = {}
+        for slot_date, slot_time in rows:
+            slots.setdefault(slot_date, []).append(slot_time)
+        return slots
+
+    def book(self, slot_date, slot_time, phone, notes="", thread_id=None, now=None):
+        """
+        Atomically reserve a place in a slot and record the booking.
+
+        Raises:
+            SlotUnavailableError: The slot is full, in the past, outside the window or already booked by this phone
+            BookingLimitError: The phone number or conversation already has max_active upcoming bookings
+
+        Returns:
+            int: Booking id
+        """
+        now = now or datetime.now()
+        today, current_time = now.date().isoformat(), now.strftime("%H:%M")
+        if (slot_date, slot_time) <= (today, current_time):
+            raise SlotUnavailableError(f"{slot_date} {slot_time} is in the past")
+        self.ensure_slots(now.date())
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for column, value in (("phone", phone), ("thread_id", thread_id)):
+                if value is None:
+                    continue
+                active = conn.execute(
+                    f"SELECT COUNT(*) FROM bookings WHERE {column} = ? "
+                    "AND (slot_date > ? OR (slot_date = ? AND slot_time > ?))",
+                    (value, today, today, current_time),
+                ).fetchone()[0]
+                if active >= self.max_active:
+                    raise BookingLimitError(f"{active} upcoming bookings already made for this {column}")
+            reserved = conn.execute(
+                "UPDATE slots SET booked = booked + 1 "
+                "WHERE slot_date = ? AND slot_time = ? AND booked < capacity",
+                (slot_date, slot_time),
+            ).rowcount
+            if not reserved:
+                raise SlotUnavailableError(f"{slot_date} {slot_time} is not available")
+            try:
+                cursor = conn.execute(
+                    "INSERT INTO bookings (slot_date, slot_time, phone, notes, thread_id, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (slot_date, slot_time, phone, notes, thread_id, time.time()),
+                )
+            except sqlite3.IntegrityError:
+                raise SlotUnavailableError(f"{phone} already has a booking at {slot_date} {slot_time}")
+            conn.execute("COMMIT")
+            return cursor.lastrowid
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_booking_store():
+    """Process-wide booking store"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BookingStore()
+        return _store
+
+__all__ = ['BookingStore', 'SlotUnavailableError', 'BookingLimitError', 'get_booking_store', 'SLOT_TIMES', 'BOOKING_WINDOW_DAYS']
@@ -0,0 +1,95 @@
+import os
+import time
+import sqlite3
+import threading
+
+CHAT_HISTORY_DB = os.getenv("CHAT_HISTORY_DB", "chat_history.sqlite")
+# The chat renders this many recent messages live; older ones are paged in on demand
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "20"))
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "20"))
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS messages (
+        thread_id TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (thread_id, id)
+    ) WITHOUT ROWID""",
+]
+
+class ChatHistoryStore:
+    """
+    Chat transcripts in SQLite, one numbered message sequence per conversation.
+
+    Message ids are stable and increase within a thread, so the UI can keep
+    only a window of recent messages in session state and page older ones
+    by id range.
+    """
+
+    def __init__(self, path=CHAT_HISTORY_DB):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+        self._conn.commit()
+
+    def append(self, thread_id, messages):
+        """
+        Store messages at the end of a conversation.
+
+        Args:
+            thread_id (str): Conversation id
+            messages (list): Dicts with role and content
+
+        Returns:
+            list: The messages with their assigned ids
+        """
+        with self._lock, self._conn:
+            (last_id,) = self._conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM messages WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+            stored = [
+                {"id": last_id + i, "role": message["role"], "content": message["content"]}
+                for i, message in enumerate(messages, 1)
+            ]
+            self._conn.executemany(
+                "INSERT INTO messages (thread_id, id, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(thread_id, message["id"], message["role"], message["content"], time.time()) for message in stored],
+            )
+            return stored
+
+    def recent(self, thread_id, limit=CHAT_HISTORY_WINDOW):
+        """The last messages of a conversation, oldest first"""
+        return self.before(thread_id, None, limit)
+
+    def before(self, thread_id, before_id, limit=CHAT_HISTORY_PAGE_SIZE):
+        """Up to limit messages older than before_id (all messages when None), oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, role, content FROM messages WHERE thread_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (thread_id, before_id if before_id is not None else 2 ** 62, limit),
+            ).fetchall()
+        return [{"id": id, "role": role, "content": content} for id, role, content in reversed(rows)]
+
+    def delete_thread(self, thread_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM messages WHERE thread_id = ?", (thread_id,))
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_chat_history_store():
+    """Process-wide chat history store"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ChatHistoryStore()
+        return _store
+
+__all__ = ['ChatHistoryStore', 'get_chat_history_store', 'CHAT_HISTORY_WINDOW', 'CHAT_HISTORY_PAGE_SIZE']
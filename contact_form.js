@@ -1,26 +1,62 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { Calendar } from 'lucide-react';
 import { Alert, AlertDescription } from '@/components/ui/alert';
 
-const ContactCalendarForm = () => {
+// Free slots and bookings come from the chatbot service (server.py)
+const ContactCalendarForm = ({ apiUrl = '', threadId = null }) => {
   const [phone, setPhone] = useState('');
   const [selectedDate, setSelectedDate] = useState('');
   const [selectedTime, setSelectedTime] = useState('');
+  const [slots, setSlots] = useState({});
+  const [error, setError] = useState('');
+  const [submitting, setSubmitting] = useState(false);
   const [submitted, setSubmitted] = useState(false);
-  
-  // Generate available time slots for the selected date
-  const generateTimeSlots = () => {
-    const slots = [];
-    for (let hour = 9; hour <= 17; hour++) {
-      slots.push(`${hour.toString().padStart(2, '0')}:00`);
-      slots.push(`${hour.toString().padStart(2, '0')}:30`);
+
+  // Load the free slots for the booking window: {"YYYY-MM-DD": ["HH:MM", ...]}
+  const loadSlots = async () => {
+    try {
+      const response = await fetch(`${apiUrl}/slots`);
+      const data = await response.json();
+      setSlots(data.slots);
+    } catch (e) {
+      setError('Could not load available times. Please try again later.');
     }
-    return slots;
   };
 
-  const handleSubmit = (e) => {
+  useEffect(() => {
+    loadSlots();
+  }, [apiUrl]);
+
+  const dates = Object.keys(slots);
+  const timeSlots = slots[selectedDate] || [];
+
+  const handleSubmit = async (e) => {
     e.preventDefault();
-    setSubmitted(true);
+    setSubmitting(true);
+    setError('');
+    try {
+      const response = await fetch(`${apiUrl}/bookings`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ date: selectedDate, time: selectedTime, phone, thread_id: threadId }),
+      });
+      if (response.status === 409) {
+        // Someone else took the slot since the list was loaded
+        setError('Sorry, that time was just booked by someone else. Please choose another slot.');
+        setSelectedTime('');
+        await loadSlots();
+      } else if (response.status === 429) {
+        setError('You already have upcoming consultations booked. Our advisor will call you at the booked time.');
+      } else if (!response.ok) {
+        setError('Could not schedule the call. Please check your details and try again.');
+      } else {
+        setSubmitted(true);
+      }
+    } catch (e) {
+      setError('Could not schedule the call. Please try again later.');
+    } finally {
+      setSubmitting(false);
+    }
   };
 
   if (submitted) {
@@ -37,6 +73,11 @@ const ContactCalendarForm = () => {
   return (
     <div className="mt-4 p-4 border rounded-lg bg-white shadow-sm">
       <h3 className="text-lg font-semibold mb-4">Schedule a Consultation</h3>
+      {error && (
+        <Alert className="mb-4">
+          <AlertDescription>{error}</AlertDescription>
+        </Alert>
+      )}
       <form onSubmit={handleSubmit} className="space-y-4">
         <div>
           <label className="block text-sm font-medium mb-1">Phone Number</label>
@@ -50,19 +91,23 @@ const ContactCalendarForm = () => {
             className="w-full p-2 border rounded focus:ring-2 focus:ring-blue-500"
           />
         </div>
-        
+
         <div>
           <label className="block text-sm font-medium mb-1">Preferred Date</label>
           <input
             type="date"
             value={selectedDate}
-            onChange={(e) => setSelectedDate(e.target.value)}
-            min={new Date().toISOString().split('T')[0]}
+            onChange={(e) => {
+              setSelectedDate(e.target.value);
+              setSelectedTime('');
+            }}
+            min={dates[0]}
+            max={dates[dates.length - 1]}
             required
             className="w-full p-2 border rounded focus:ring-2 focus:ring-blue-500"
           />
         </div>
-        
+
         <div>
           <label className="block text-sm font-medium mb-1">Preferred Time</label>
           <select
@@ -71,24 +116,25 @@ const ContactCalendarForm = () => {
             required
             className="w-full p-2 border rounded focus:ring-2 focus:ring-blue-500"
           >
-            <option value="">Select a time</option>
-            {generateTimeSlots().map((time) => (
+            <option value="">{timeSlots.length ? 'Select a time' : 'No free times on this date'}</option>
+            {timeSlots.map((time) => (
               <option key={time} value={time}>
                 {time}
               </option>
             ))}
           </select>
         </div>
-        
+
         <button
           type="submit"
+          disabled={submitting}
           className="w-full bg-blue-600 text-white py-2 px-4 rounded hover:bg-blue-700 transition-colors"
         >
-          Schedule Call
+          {submitting ? 'Scheduling...' : 'Schedule Call'}
         </button>
       </form>
     </div>
   );
 };
 
-export default ContactCalendarForm;
\ No newline at end of file
+export default ContactCalendarForm;
@@ -0,0 +1,158 @@
+import os
+import re
+import threading
+import tiktoken
+
+# Retrieved chunks are packed into at most this many prompt tokens
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2500"))
+# MMR retrieval: candidates fetched, chunks kept, and relevance vs. diversity (1.0 = pure relevance)
+MMR_FETCH_K = int(os.getenv("MMR_FETCH_K", "40"))
+MMR_K = int(os.getenv("MMR_K", "10"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+
+_encoding = tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text):
+    return len(_encoding.encode(text))
+
+def truncate_tokens(text, limit, keep="start"):
+    """Cut text to at most limit tokens, keeping its start or its end"""
+    tokens = _encoding.encode(text)
+    if len(tokens) <= limit:
+        return text
+    return _encoding.decode(tokens[:limit] if keep == "start" else tokens[-limit:])
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+def _text_overlap(left, right, max_overlap=400):
+    """Length of the longest suffix of left that is also a prefix of right"""
+    for size in range(min(len(left), len(right), max_overlap), 0, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+def merge_chunks(docs):
+    """
+    Merge chunks from the same source and page into contiguous segments.
+
+    Chunks with start_index metadata are merged by offset; otherwise the
+    overlapping text is found by matching the end of one chunk against the
+    start of the next. Returns (segments, stats) where each segment is a
+    dict with text, category, source, page and the best rank of its chunks.
+    """
+    stats = {"duplicate_chunks": 0, "merged_chunks": 0, "overlap_chars_removed": 0}
+    seen = set()
+    groups = {}
+    for rank, doc in enumerate(docs):
+        key = _normalize(doc.page_content)
+        if key in seen:
+            # Identical boilerplate from another brochure adds nothing
+            stats["duplicate_chunks"] += 1
+            continue
+        seen.add(key)
+        metadata = doc.metadata
+        groups.setdefault((metadata.get("source"), metadata.get("page")), []).append((rank, doc))
+
+    segments = []
+    for (source, page), items in groups.items():
+        items.sort(key=lambda item: (item[1].metadata.get("start_index", -1), item[0]))
+        current = None
+        for rank, doc in items:
+            text = doc.page_content
+            start = doc.metadata.get("start_index")
+            if current is not None:
+                if start is not None and current["end"] is not None and start <= current["end"] + 2:
+                    overlap = max(0, current["end"] - start)
+                elif start is None or current["end"] is None:
+                    overlap = _text_overlap(current["text"], text)
+                else:
+                    overlap = None
+                if overlap is not None and (overlap or start is not None):
+                    stats["merged_chunks"] += 1
+                    stats["overlap_chars_removed"] += overlap
+                    current["text"] += ("" if overlap else "\n") + text[overlap:]
+                    current["end"] = start + len(text) if start is not None else None
+                    current["rank"] = min(current["rank"], rank)
+                    continue
+                segments.append(current)
+            current = {
+                "text": text,
+                "category": doc.metadata.get("category"),
+                "source": source,
+                "page": page,
+                "rank": rank,
+                "end": start + len(text) if start is not None else None,
+            }
+        if current is not None:
+            segments.append(current)
+
+    segments.sort(key=lambda segment: segment["rank"])
+    return segments, stats
+
+def pack_segments(segments, budget):
+    """Keep segments in relevance order while they fit in the token budget"""
+    kept, tokens_kept, dropped, tokens_dropped = [], 0, 0, 0
+    for segment in segments:
+        tokens = count_tokens(segment["text"])
+        if tokens_kept + tokens <= budget:
+            kept.append(segment)
+            tokens_kept += tokens
+        else:
+            dropped += 1
+            tokens_dropped += tokens
+    return kept, {
+        "segments_kept": len(kept),
+        "segments_dropped": dropped,
+        "tokens_kept": tokens_kept,
+        "tokens_dropped": tokens_dropped,
+    }
+
+def build_context(docs, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Turn retrieved chunks into a deduplicated context that fits the token budget.
+
+    Returns:
+        tuple: (list of kept segments, stats dict)
+    """
+    segments, merge_stats = merge_chunks(docs)
+    kept, pack_stats = pack_segments(segments, budget)
+    raw_tokens = sum(count_tokens(doc.page_content) for doc in docs)
+    stats = {
+        "chunks_retrieved": len(docs),
+        **merge_stats,
+        **pack_stats,
+        "raw_tokens": raw_tokens,
+        "tokens_saved": raw_tokens - pack_stats["tokens_kept"],
+    }
+    return kept, stats
+
+def format_segments(segments, group_by_category=False):
+    """Render segments as prompt context, optionally under per-category headings"""
+    if not group_by_category:
+        return "\n\n".join(segment["text"] for segment in segments)
+    sections = {}
+    for segment in segments:
+        sections.setdefault(segment["category"], []).append(segment["text"])
+    return "\n\n".join(f"[{category} plans]\n" + "\n\n".join(texts) for category, texts in sections.items())
+
+class ContextStats:
+    """Running totals of context assembly, to see what the builder keeps and drops"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {}
+        self.last = {}
+
+    def record(self, stats):
+        with self._lock:
+            self.last = dict(stats)
+            self.totals["requests"] = self.totals.get("requests", 0) + 1
+            for key, value in stats.items():
+                self.totals[key] = self.totals.get(key, 0) + value
+
+    def get_stats(self):
+        with self._lock:
+            return {"totals": dict(self.totals), "last": dict(self.last)}
+
+__all__ = ['build_context', 'merge_chunks', 'count_tokens', 'truncate_tokens', 'format_segments', 'ContextStats', 'CONTEXT_TOKEN_BUDGET', 'MMR_FETCH_K', 'MMR_K', 'MMR_LAMBDA']
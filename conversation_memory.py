@@ -0,0 +1,128 @@
+import os
+from langchain.prompts import ChatPromptTemplate
+from context_builder import count_tokens, truncate_tokens
+from llm_clients import get_chat_model
+
+# The last MEMORY_TURNS turns are kept verbatim; once twice that many have
+# piled up, the oldest MEMORY_TURNS are folded into the running summary
+MEMORY_TURNS = int(os.getenv("MEMORY_TURNS", "4"))
+# Each stored message is cut to this many tokens (recommendations can run to thousands)
+MEMORY_MAX_MESSAGE_TOKENS = int(os.getenv("MEMORY_MAX_MESSAGE_TOKENS", "300"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "250"))
+
+# Conversation context each agent's prompt may spend, in tiktoken tokens
+MEMORY_BUDGETS = {
+    "router": int(os.getenv("MEMORY_BUDGET_ROUTER", "300")),
+    "sales_agent": int(os.getenv("MEMORY_BUDGET_SALES", "800")),
+    "product_agent": int(os.getenv("MEMORY_BUDGET_PRODUCT", "600")),
+}
+DEFAULT_MEMORY_BUDGET = 500
+
+NO_HISTORY = "None so far."
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You maintain a running summary of a conversation between a customer and an MB Ageas life insurance assistant. "
+               "Merge the new lines into the summary. Keep the customer's situation, stated needs, products discussed and any decisions; "
+               "drop greetings and repetition. Answer with the updated summary only, in at most {max_words} words."),
+    ("human", "Current summary:\n{summary}\n\nNew lines:\n{lines}"),
+])
+summary_chain = SUMMARY_PROMPT | get_chat_model("gpt-4o-mini", temperature=0)
+
+def format_turns(turns):
+    return "\n".join(f"Customer: {turn['user']}\nAssistant: {turn['assistant']}" for turn in turns)
+
+def add_turn(memory, user_input, output):
+    """
+    The memory with one more turn, without folding.
+
+    Args:
+        memory (dict | None): {"summary": str, "turns": [{"user", "assistant"}]}
+        user_input (str): The customer's message
+        output (str): The assistant's answer
+    """
+    memory = memory or {"summary": "", "turns": []}
+    return {
+        "summary": memory["summary"],
+        "turns": memory["turns"] + [{
+            "user": truncate_tokens(str(user_input), MEMORY_MAX_MESSAGE_TOKENS),
+            "assistant": truncate_tokens(str(output), MEMORY_MAX_MESSAGE_TOKENS),
+        }],
+    }
+
+def needs_fold(memory):
+    """Whether the verbatim window has overflowed and its oldest turns should be summarized"""
+    return bool(memory) and len(memory["turns"]) >= 2 * MEMORY_TURNS
+
+def fold_memory(memory):
+    """
+    Summarize the oldest turns of an overflowing memory (one LLM call).
+
+    Returns:
+        tuple: (new summary, the folded turns), for apply_fold
+    """
+    folded = memory["turns"][:-MEMORY_TURNS]
+    summary = summary_chain.invoke({
+        "summary": memory["summary"] or NO_HISTORY,
+        "lines": format_turns(folded),
+        "max_words": int(MEMORY_SUMMARY_TOKENS * 0.75),
+    }).content.strip()
+    return summary, folded
+
+def apply_fold(memory, base_summary, summary, folded):
+    """
+    Replace the folded turns with the new summary in a memory that may have grown since the fold started.
+
+    Returns None when the memory no longer starts from what was folded
+    (another fold or a reset happened in between).
+    """
+    if not memory or memory["summary"] != base_summary or memory["turns"][:len(folded)] != folded:
+        return None
+    return {"summary": summary, "turns": memory["turns"][len(folded):]}
+
+def update_memory(memory, user_input, output):
+    """
+    Add one turn to the memory, folding the oldest turns into the summary when the window overflows.
+
+    Makes the summary call inline; graph turns fold in the job queue instead (graph.memory_node).
+
+    Returns:
+        dict: The new memory
+    """
+    memory = add_turn(memory, user_input, output)
+    if not needs_fold(memory):
+        return memory
+    try:
+        summary, folded = fold_memory(memory)
+    except Exception as e:
+        # Keep the turns rather than lose them; the fold is retried next turn
+        print(f"Error updating conversation summary: {str(e)}")
+        return memory
+    return apply_fold(memory, memory["summary"], summary, folded)
+
+def memory_context(memory, agent):
+    """
+    Conversation context for one agent's prompt, within that agent's token budget.
+
+    The summary takes at most half the budget; the rest is filled with the
+    most recent verbatim turns, newest first.
+    """
+    if not memory or not (memory.get("summary") or memory.get("turns")):
+        return NO_HISTORY
+    budget = MEMORY_BUDGETS.get(agent, DEFAULT_MEMORY_BUDGET)
+    parts = []
+    if memory.get("summary"):
+        summary = "Summary of earlier conversation: " + truncate_tokens(memory["summary"], budget // 2)
+        parts.append(summary)
+        budget -= count_tokens(summary)
+    recent = []
+    for turn in reversed(memory.get("turns", [])):
+        text = format_turns([turn])
+        tokens = count_tokens(text)
+        if tokens > budget:
+            break
+        recent.append(text)
+        budget -= tokens
+    parts.extend(reversed(recent))
+    return "\n".join(parts)
+
+__all__ = ['memory_context', 'add_turn', 'needs_fold', 'fold_memory', 'apply_fold', 'update_memory', 'NO_HISTORY']
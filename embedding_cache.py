@@ -0,0 +1,140 @@
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+import tiktoken
+from langchain_core.embeddings import Embeddings
+
+# Misses are sent to the embeddings API in batches of this size
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "512"))
+# Query vectors are kept in memory only, for this many most recently used queries
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048"))
+
+def normalize_text(text):
+    """Normalize chunk text so trivially different copies share a cache entry"""
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+def count_tokens(texts, model="text-embedding-ada-002"):
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return sum(len(encoding.encode(text)) for text in texts)
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed embedding store in front of an embeddings model.
+
+    Vectors are kept in SQLite keyed by a hash of the model name and the
+    normalized text, so identical chunks are embedded once no matter which
+    knowledge base or rebuild they come from. Only misses reach the API.
+    User queries are mostly one-off, so their vectors go to a bounded
+    in-memory LRU instead of the SQLite store.
+    """
+
+    def __init__(self, embeddings, model, path, batch_size=EMBEDDING_BATCH_SIZE, query_cache_size=QUERY_EMBEDDING_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.model = model
+        self.batch_size = batch_size
+        self.query_cache_size = query_cache_size
+        self._queries = OrderedDict()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT, vector BLOB)"
+        )
+        self._conn.commit()
+        self.stats = {"hits": 0, "misses": 0, "tokens": 0}
+
+    def _key(self, text):
+        payload = f"{self.model}\n{normalize_text(text)}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def _lookup(self, keys):
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def _store(self, items):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector) VALUES (?, ?, ?)",
+                [(key, self.model, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items],
+            )
+            self._conn.commit()
+
+    def embed_documents_with_stats(self, texts):
+        """
+        Embed texts through the cache.
+
+        Returns:
+            tuple: (list of vectors, dict with hits, misses and tokens sent to the API)
+        """
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(keys)
+
+        # Deduplicate misses so repeated boilerplate in one call is embedded once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        missing_items = list(missing.items())
+        for start in range(0, len(missing_items), self.batch_size):
+            batch = missing_items[start:start + self.batch_size]
+            vectors = self.embeddings.embed_documents([text for _, text in batch])
+            self._store([(key, vector) for (key, _), vector in zip(batch, vectors)])
+            for (key, _), vector in zip(batch, vectors):
+                found[key] = vector
+
+        stats = {
+            "hits": len(texts) - len(missing),
+            "misses": len(missing),
+            "tokens": count_tokens(missing.values(), self.model) if missing else 0,
+        }
+        with self._lock:
+            for name, value in stats.items():
+                self.stats[name] += value
+        return [found[key] for key in keys], stats
+
+    def embed_documents(self, texts):
+        vectors, _ = self.embed_documents_with_stats(texts)
+        return vectors
+
+    def embed_query(self, text):
+        key = self._key(text)
+        with self._lock:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+                self.stats["hits"] += 1
+                return vector
+        vector = self.embeddings.embed_query(text)
+        with self._lock:
+            self._queries[key] = vector
+            self._queries.move_to_end(key)
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+            self.stats["misses"] += 1
+            self.stats["tokens"] += count_tokens([text], self.model)
+        return vector
+
+__all__ = ['CachedEmbeddings', 'count_tokens']
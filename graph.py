@@ -1,23 +1,312 @@
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
 from langgraph.graph import StateGraph, END
-from typing import TypedDict
+from langgraph.checkpoint.memory import MemorySaver
+from typing import TypedDict, Annotated
 from agent import router, sales_agent, needs_agent
+from needs_agent import needs_agent as needs_questionnaire, needs_submission, completed, QUESTIONS, NEEDS_FLOW, NEEDS_AGENT_START
 from product_agent import product_agent
+from recommendation_agent import lookup_recommendation, stream_recommendations
+from conversation_memory import update_memory, add_turn, needs_fold, fold_memory, apply_fold
+from job_queue import get_job_queue, QueueFullError
 
-class AgentState(TypedDict):
+# Per-conversation state is kept by a checkpointer keyed by thread_id:
+# "memory" (default, this process only) or "sqlite" (stored in GRAPH_CHECKPOINT_DB, shared between processes)
+GRAPH_CHECKPOINTER = os.getenv("GRAPH_CHECKPOINTER", "memory")
+GRAPH_CHECKPOINT_DB = os.getenv("GRAPH_CHECKPOINT_DB", "checkpoints.sqlite")
+# The in-memory checkpointer keeps this many checkpoints per conversation and this many conversations
+GRAPH_CHECKPOINT_HISTORY = int(os.getenv("GRAPH_CHECKPOINT_HISTORY", "2"))
+GRAPH_MAX_THREADS = int(os.getenv("GRAPH_MAX_THREADS", "10000"))
+# Routing decisions kept per conversation, newest last
+GRAPH_DECISION_HISTORY = int(os.getenv("GRAPH_DECISION_HISTORY", "20"))
+# Graph node that records each turn in the conversation memory; node names must differ from AgentState keys
+MEMORY_NODE = "fold_memory"
+# Purchase intent opens the quick "form" (default) or the step-by-step chat "questionnaire"
+NEEDS_MODE = os.getenv("NEEDS_MODE", "form")
+# A job started by a turn waits up to this many seconds for that turn's last checkpoint before saving its result
+JOB_SAVE_WAIT = float(os.getenv("JOB_SAVE_WAIT", "30"))
+
+RECOMMENDATIONS_PENDING = "Thank you! I'm preparing your recommendations, they will appear here in a moment."
+RECOMMENDATIONS_BUSY = "Sorry, we are handling a lot of requests right now. Please try again in a few minutes."
+
+def recent_decisions(decisions, new_decisions):
+    """Reducer for AgentState.decisions: append, keeping only the last GRAPH_DECISION_HISTORY"""
+    return (decisions + new_decisions)[-GRAPH_DECISION_HISTORY:]
+
+class AgentState(TypedDict, total=False):
     input: str
     output: str
     decision: str
+    decisions: Annotated[list, recent_decisions]
+    active_flow: str
+    memory: dict
+    show_form: bool
+    show_contact_form: bool
+    form_data: dict
+    needs_step: int
+    needs_responses: dict
+    needs_answers: dict
+    current_question: dict
+    progress: dict
+    needs_complete: bool
+    recommendations_generated: bool
+    recommendations: str
+    recommendation_job: str
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    MemorySaver that only keeps the latest checkpoints of the most recent conversations.
+
+    The stock MemorySaver keeps every checkpoint of every thread forever;
+    here a conversation costs its current state plus a short history.
+    Every access to the storage dicts holds one lock, as turns of different
+    conversations run on different threads while pruning deletes threads.
+    """
+
+    def __init__(self, history=GRAPH_CHECKPOINT_HISTORY, max_threads=GRAPH_MAX_THREADS):
+        super().__init__()
+        self.history = history
+        self.max_threads = max_threads
+        self._recent_threads = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            result = super().get_tuple(config)
+            # The storage is a defaultdict; don't keep entries for threads that were only looked up
+            if not any(self.storage.get(thread_id, {}).values()):
+                self.storage.pop(thread_id, None)
+            return result
+
+    def put_writes(self, config, writes, task_id):
+        with self._lock:
+            return super().put_writes(config, writes, task_id)
+
+    def put(self, config, checkpoint, metadata, *args, **kwargs):
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            result = super().put(config, checkpoint, metadata, *args, **kwargs)
+            for checkpoint_ns, checkpoints in self.storage[thread_id].items():
+                # Checkpoint ids are time-ordered, so the oldest sort first
+                for checkpoint_id in sorted(checkpoints)[:-self.history]:
+                    del checkpoints[checkpoint_id]
+                    self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            self._recent_threads[thread_id] = True
+            self._recent_threads.move_to_end(thread_id)
+            while len(self._recent_threads) > self.max_threads:
+                stale_thread, _ = self._recent_threads.popitem(last=False)
+                self.delete_thread(stale_thread)
+        return result
+
+    def delete_thread(self, thread_id):
+        with self._lock:
+            self.storage.pop(thread_id, None)
+            for key in [key for key in list(self.writes) if key[0] == thread_id]:
+                del self.writes[key]
+
+def recommendation_job_key(thread_id):
+    """One recommendation job per conversation; repeated submissions join the running one"""
+    return f"recommendations:{thread_id}"
+
+def turn_finished(config, job_id):
+    """
+    Wait until the turn that started job job_id has written its last checkpoint.
+
+    That turn ends with recommendation_job set to job_id and no nodes left to
+    run; a state update made before then would be overwritten by the turn's
+    own final checkpoint. Gives up after JOB_SAVE_WAIT seconds.
+
+    Returns:
+        StateSnapshot: The conversation state to apply the job's result to
+    """
+    deadline = time.monotonic() + JOB_SAVE_WAIT
+    while True:
+        snapshot = call_graph("get_state", config)
+        if not snapshot.next and snapshot.values.get("recommendation_job") == job_id:
+            return snapshot
+        if time.monotonic() >= deadline:
+            print(f"Job {job_id}: its turn did not finish within {JOB_SAVE_WAIT}s, saving the result anyway")
+            return snapshot
+        time.sleep(0.05)
+
+def save_job_result(thread_id, user_input, update, job_id=None):
+    """
+    Write a finished job's answer into the conversation state as a completed, remembered turn.
+
+    A job_id means the job was started from within a turn; the result is then
+    written only once that turn has finished.
+    """
+    config = thread_config(thread_id)
+    if job_id is None:
+        snapshot = call_graph("get_state", config)
+    else:
+        snapshot = turn_finished(config, job_id)
+    memory = snapshot.values.get("memory")
+    call_graph(
+        "update_state",
+        config,
+        {**update, "recommendation_job": None, "memory": update_memory(memory, user_input, update["output"])},
+        as_node=MEMORY_NODE
+    )
+
+def submit_job(thread_id, user_input, generate, in_turn=False):
+    """
+    Run generate(job) in the job queue; the state update it returns is saved as a turn of the conversation.
+
+    in_turn marks jobs started from a graph node, whose result must wait for the turn to end.
+
+    Raises:
+        QueueFullError: Too many jobs are pending
+    """
+    def run(job):
+        update = generate(job)
+        save_job_result(thread_id, user_input, update, job.id if in_turn else None)
+        return update
+
+    return get_job_queue().submit(recommendation_job_key(thread_id), run)
+
+def deferred_turn(thread_id, user_input, generate):
+    """The immediate answer of a turn whose recommendations are generated in the job queue"""
+    try:
+        job = submit_job(thread_id, user_input, generate, in_turn=True)
+    except QueueFullError:
+        return {"output": RECOMMENDATIONS_BUSY, "show_contact_form": False}
+    return {"output": RECOMMENDATIONS_PENDING, "show_contact_form": False, "recommendation_job": job.id}
+
+def submit_recommendations(thread_id, form_data, language="en"):
+    """
+    Generate quick-form recommendations in the job queue.
+
+    The job streams the text into its progress and, when done, stores the
+    profile (with its language) and answer in the conversation state for
+    follow-up turns.
 
-def create_graph():
+    Raises:
+        QueueFullError: Too many jobs are pending
+    """
+    def generate(job):
+        for token in stream_recommendations(form_data, language):
+            job.progress(token)
+        return {"form_data": {**form_data, "language": language}, "output": job.partial, "show_contact_form": True}
+
+    return submit_job(thread_id, "(submitted the quick needs form)", generate)
+
+def recommendation_node(state, config):
+    """Recommend from the quick-form profile saved in this conversation, or ask for the form first"""
+    form_data = state.get("form_data")
+    if not form_data:
+        return needs_agent(state)
+    language = form_data.get("language", "en")
+    _, _, stored = lookup_recommendation(form_data, language)
+    if stored is not None:
+        return {"output": stored, "show_contact_form": True, "recommendation_job": None}
+
+    # A table miss means an LLM call; make it in the job queue rather than within the turn
+    def generate(job):
+        for token in stream_recommendations(form_data, language):
+            job.progress(token)
+        return {"output": job.partial, "show_contact_form": True}
+
+    return deferred_turn(config["configurable"]["thread_id"], state["input"], generate)
+
+def deferred_finish(thread_id, user_input, result=None):
+    """A questionnaire finish(needs_responses) that generates the recommendations in the job queue"""
+    def finish(needs_responses):
+        def generate(job):
+            return {**completed(needs_responses, on_token=job.progress), **(result or {})}
+
+        return {
+            **deferred_turn(thread_id, user_input, generate),
+            "decision": NEEDS_FLOW,
+            "active_flow": None,
+            "needs_step": len(QUESTIONS),
+            "needs_responses": needs_responses,
+            "needs_complete": True,
+            "current_question": None,
+            "progress": None
+        }
+
+    return finish
+
+def needs_flow_node(state, config):
+    """The chat questionnaire; its recommendations are generated in the job queue rather than within the turn"""
+    finish = deferred_finish(config["configurable"]["thread_id"], "(completed the needs questionnaire)")
+    # A job id only belongs to the turn that started the job
+    return {"recommendation_job": None, **needs_questionnaire(state, finish)}
+
+def needs_submission_node(state, config):
+    """A questionnaire submitted in one request; its recommendations are generated in the job queue"""
+    finish = deferred_finish(config["configurable"]["thread_id"], "(submitted the needs questionnaire)", {"show_contact_form": True})
+    return {"recommendation_job": None, **needs_submission(state, finish)}
+
+def fold_memory_job(job, thread_id, memory):
+    """Summarize the oldest turns of a snapshot of the memory and write the result back into the conversation"""
+    summary, folded = fold_memory(memory)
+    config = thread_config(thread_id)
+    current = call_graph("get_state", config).values.get("memory")
+    folded_memory = apply_fold(current, memory["summary"], summary, folded)
+    if folded_memory is not None:
+        call_graph("update_state", config, {"memory": folded_memory}, as_node=MEMORY_NODE)
+    return {"folded": len(folded), "applied": folded_memory is not None}
+
+def memory_node(state, config):
+    """
+    Graph node run after every answer: remember the turn for the next ones.
+
+    Summarizing overflowing turns takes an LLM call, so it runs in the job
+    queue after the turn instead of delaying the answer; until it lands the
+    window just holds a few more verbatim turns.
+    """
+    memory = add_turn(state.get("memory"), state.get("input", ""), state.get("output", ""))
+    if needs_fold(memory):
+        thread_id = config["configurable"]["thread_id"]
+        try:
+            get_job_queue().submit(f"memory:{thread_id}", fold_memory_job, thread_id, memory)
+        except QueueFullError:
+            pass  # Retried on the next turn
+    return {"memory": memory}
+
+def entry_route(state):
+    """Send turns of an unfinished multi-step flow straight to the node that owns it, everything else to the router"""
+    if state.get("needs_answers"):
+        # A complete questionnaire submitted in one request
+        return "needs_submission"
+    if state.get("input") == NEEDS_AGENT_START:
+        return NEEDS_FLOW
+    return state.get("active_flow") or "router"
+
+def create_checkpointer():
+    if GRAPH_CHECKPOINTER == "sqlite":
+        if _event_loop is not None:
+            # SqliteSaver has no async methods, which ainvoke/astream_events/aget_state need
+            import aiosqlite
+            from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+            return AsyncSqliteSaver(aiosqlite.connect(GRAPH_CHECKPOINT_DB))
+        from langgraph.checkpoint.sqlite import SqliteSaver
+        return SqliteSaver(sqlite3.connect(GRAPH_CHECKPOINT_DB, check_same_thread=False))
+    return BoundedMemorySaver()
+
+def create_graph(checkpointer=None, needs_mode=NEEDS_MODE):
     # Initialize the graph
     workflow = StateGraph(AgentState)
+    # The router's purchase intent opens the quick form (needs_agent) or the chat questionnaire
+    needs_node = NEEDS_FLOW if needs_mode == "questionnaire" else "needs_agent"
 
-    # Add nodes for each agent
+    # Add nodes for each agent; only the needs node the router can reach is registered
     workflow.add_node("router", router)
-    workflow.add_node("needs_agent", needs_agent)
+    if needs_node == "needs_agent":
+        workflow.add_node("needs_agent", needs_agent)
+    workflow.add_node(NEEDS_FLOW, needs_flow_node)
+    workflow.add_node("needs_submission", needs_submission_node)
     workflow.add_node("sales_agent", sales_agent)
     workflow.add_node("product_agent", product_agent)
-    workflow.add_node("recommendation_agent", lambda x: {"output": recommendation_agent(x)["output"]})
+    workflow.add_node("recommendation_agent", recommendation_node)
+    workflow.add_node(MEMORY_NODE, memory_node)
 
     # Add conditional edges from router to agents
     workflow.add_conditional_edges(
@@ -25,21 +314,64 @@ def create_graph():
         lambda x: x["decision"],
         {
             "sales_agent": "sales_agent",
-            "needs_agent": "needs_agent",
+            "needs_agent": needs_node,
             "product_agent": "product_agent",
             "recommendation_agent": "recommendation_agent"
         }
     )
 
-    # Set entry point and end points
-    workflow.set_entry_point("router")
-    workflow.add_edge("sales_agent", END)
-    workflow.add_edge("product_agent", END)
-    workflow.add_edge("needs_agent", END)
-    workflow.add_edge("recommendation_agent", END)
+    # Set entry point and end points; an active flow skips the router
+    workflow.set_conditional_entry_point(entry_route, {
+        "router": "router",
+        NEEDS_FLOW: NEEDS_FLOW,
+        "needs_submission": "needs_submission"
+    })
+    # Every answer is remembered before the turn ends
+    for node in {"sales_agent", "product_agent", needs_node, NEEDS_FLOW, "needs_submission", "recommendation_agent"}:
+        workflow.add_edge(node, MEMORY_NODE)
+    workflow.add_edge(MEMORY_NODE, END)
 
     # Compile and return the graph
-    return workflow.compile()
+    return workflow.compile(checkpointer=checkpointer)
+
+_graph = None
+_graph_lock = threading.Lock()
+# Set by serve_async when the graph is run from an asyncio server
+_event_loop = None
+
+def serve_async(loop):
+    """
+    Run the graph from an asyncio server on loop; call before the first get_graph().
+
+    The sqlite checkpointer then becomes AsyncSqliteSaver, and call_graph
+    runs state reads and writes from worker threads on the loop.
+    """
+    global _event_loop
+    _event_loop = loop
+
+def get_graph():
+    """Return the process-wide compiled graph; conversations are separated by thread_id"""
+    global _graph
+    with _graph_lock:
+        if _graph is None:
+            _graph = create_graph(checkpointer=create_checkpointer())
+        return _graph
+
+def call_graph(method, *args, **kwargs):
+    """
+    Call a compiled-graph state method (get_state, update_state) from synchronous code.
+
+    Under serve_async the async variant runs on the server's loop instead, as the
+    async checkpointer has no sync methods; never call this from the loop itself.
+    """
+    graph = get_graph()
+    if _event_loop is None:
+        return getattr(graph, method)(*args, **kwargs)
+    return asyncio.run_coroutine_threadsafe(getattr(graph, "a" + method)(*args, **kwargs), _event_loop).result()
+
+def thread_config(thread_id):
+    """Invocation config selecting a conversation's checkpointed state"""
+    return {"configurable": {"thread_id": thread_id}}
 
-# Export the create_graph function
-__all__ = ['create_graph']
\ No newline at end of file
+# Export the graph helpers
+__all__ = ['create_graph', 'get_graph', 'thread_config', 'call_graph', 'serve_async', 'submit_recommendations', 'save_job_result', 'AgentState']
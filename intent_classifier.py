@@ -0,0 +1,141 @@
+import os
+import re
+import threading
+import numpy as np
+from knowledge_base import get_embeddings
+
+LABELS = ["sales_agent", "product_agent", "needs_agent", "recommendation_agent"]
+
+# Nearest-centroid thresholds: the best label must be at least this similar to
+# the input and beat the runner-up by this margin to skip the LLM
+ROUTER_MIN_SIMILARITY = float(os.getenv("ROUTER_MIN_SIMILARITY", "0.82"))
+ROUTER_MIN_MARGIN = float(os.getenv("ROUTER_MIN_MARGIN", "0.03"))
+ROUTER_USE_EMBEDDINGS = os.getenv("ROUTER_USE_EMBEDDINGS", "1") == "1"
+
+# Unambiguous phrasings (English and Vietnamese) for each label
+KEYWORD_RULES = {
+    "product_agent": [
+        r"\b(child|children's|retirement|savings?|illness|accident|education) (plan|plans|insurance|product|products)\b",
+        r"\bwhat (plans|products) do you (have|offer)\b",
+        r"\bcompare\b.*\b(plan|plans|product|products)\b",
+        r"\b(coverage|premium|entry age|sum assured|exclusions?)\b",
+        r"\b(gói|sản phẩm) (hưu trí|tiết kiệm|bệnh hiểm nghèo|tai nạn|giáo dục)\b",
+        r"\bso sánh\b",
+    ],
+    "needs_agent": [
+        r"\b(i want|i'd like|i would like|ready) to (buy|purchase|get) (a |an |some )?(life )?(insurance|policy|plan)\b",
+        r"\bhow (do|can) i (buy|purchase|apply)\b",
+        r"\b(muốn|cần) mua bảo hiểm\b",
+    ],
+    "recommendation_agent": [
+        r"\b(recommend|recommendation|recommendations|suggest|suggestion)\b",
+        r"\bwhich (plan|product|policy) (is|would be) (best|right|suitable) for me\b",
+        r"\b(gợi ý|đề xuất|tư vấn cho tôi)\b",
+    ],
+    "sales_agent": [
+        r"^\s*(hi|hello|hey|good (morning|afternoon|evening)|thanks|thank you|xin chào|chào|cảm ơn)\b[\s!.?]*$",
+        r"\bwhat is life insurance\b",
+        r"\bbảo hiểm nhân thọ là gì\b",
+    ],
+}
+_compiled_rules = {
+    label: [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+    for label, patterns in KEYWORD_RULES.items()
+}
+
+# Labeled examples for the nearest-centroid fallback
+EXAMPLES = {
+    "sales_agent": [
+        "Hello, how are you?",
+        "I'm not sure I need insurance",
+        "Why should I get life insurance?",
+        "Tell me a bit about yourself",
+        "Bảo hiểm có cần thiết không?",
+    ],
+    "product_agent": [
+        "What child plans do you have?",
+        "Tell me about your retirement insurance products",
+        "What does the critical illness plan cover?",
+        "What is the entry age for the savings plan?",
+        "Tóm tắt các gói hưu trí",
+    ],
+    "needs_agent": [
+        "I want to buy life insurance",
+        "I'm ready to sign up for a policy",
+        "How do I purchase a plan?",
+        "Let's start the needs assessment",
+        "Tôi muốn mua bảo hiểm",
+    ],
+    "recommendation_agent": [
+        "Which plan would you recommend for me?",
+        "Can you suggest a product for my family?",
+        "What is the best plan for a 35 year old with two kids?",
+        "Following up on the recommendations you gave me",
+        "Bạn gợi ý gói nào cho tôi?",
+    ],
+}
+
+_centroids = None
+_centroids_lock = threading.Lock()
+_stats_lock = threading.Lock()
+stats = {"total": 0, "keywords": 0, "centroid": 0, "llm": 0}
+
+def get_centroids():
+    """Unit-length mean embedding of each label's examples (example embeddings are cached on disk)"""
+    global _centroids
+    with _centroids_lock:
+        if _centroids is None:
+            embeddings = get_embeddings()
+            centroids = []
+            for label in LABELS:
+                vectors = np.asarray(embeddings.embed_documents(EXAMPLES[label]), dtype=np.float32)
+                vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                centroid = vectors.mean(axis=0)
+                centroids.append(centroid / np.linalg.norm(centroid))
+            _centroids = np.stack(centroids)
+        return _centroids
+
+def classify_keywords(text):
+    matched = [label for label in LABELS if any(rule.search(text) for rule in _compiled_rules[label])]
+    if len(matched) == 1:
+        return matched[0], 1.0
+    return None, 0.0
+
+def classify_centroid(text):
+    vector = np.asarray(get_embeddings().embed_query(text), dtype=np.float32)
+    scores = get_centroids() @ (vector / np.linalg.norm(vector))
+    ranked = np.argsort(scores)[::-1]
+    best, runner_up = scores[ranked[0]], scores[ranked[1]]
+    if best >= ROUTER_MIN_SIMILARITY and best - runner_up >= ROUTER_MIN_MARGIN:
+        return LABELS[ranked[0]], float(best - runner_up)
+    return None, float(best - runner_up)
+
+def record(method):
+    with _stats_lock:
+        stats["total"] += 1
+        stats[method] += 1
+        skipped = stats["keywords"] + stats["centroid"]
+        return skipped / stats["total"]
+
+def classify(text):
+    """
+    Pick a route locally when the input is unambiguous.
+
+    Returns:
+        tuple: (label or None, confidence, method). A None label means the
+        caller should fall back to the LLM router.
+    """
+    label, confidence = classify_keywords(text)
+    if label:
+        return label, confidence, "keywords"
+    if ROUTER_USE_EMBEDDINGS:
+        try:
+            label, confidence = classify_centroid(text)
+        except Exception as e:
+            print(f"Centroid routing failed: {str(e)}")
+            label, confidence = None, 0.0
+        if label:
+            return label, confidence, "centroid"
+    return None, confidence, "llm"
+
+__all__ = ['classify', 'record', 'LABELS', 'stats']
@@ -0,0 +1,178 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Slow LLM work (recommendations) runs on this many worker threads instead of the caller's
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Submissions beyond this many queued or running jobs are refused
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "100"))
+# Finished jobs stay readable this long so their result can be picked up
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "600"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+class QueueFullError(RuntimeError):
+    """JOB_MAX_PENDING jobs are already queued or running"""
+
+class Job:
+    """One unit of background work; progress text accumulates while it runs"""
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self._partial = []
+
+    def progress(self, text):
+        """Append streamed output; readers see it through .partial while the job runs"""
+        self._partial.append(text)
+
+    @property
+    def partial(self):
+        return "".join(self._partial)
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+class JobQueue:
+    """
+    Bounded worker pool for jobs keyed by who asked for them.
+
+    A job submitted under a key that already has an unfinished job is not
+    run again; the caller gets the existing job. Callers poll a job by id
+    and pick up its result when it is done.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING, result_ttl=JOB_RESULT_TTL):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jobs")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._active = {}
+        self.submitted = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        Run fn(job, *args, **kwargs) on the pool, unless key already has an unfinished job.
+
+        Raises:
+            QueueFullError: Too many jobs are queued or running
+
+        Returns:
+            Job: The new job, or the one already running for key
+        """
+        with self._lock:
+            self._prune()
+            active = self._jobs.get(self._active.get(key))
+            if active is not None and not active.finished:
+                self.deduplicated += 1
+                return active
+            if self._pending() >= self.max_pending:
+                self.rejected += 1
+                raise QueueFullError(f"{self.max_pending} jobs are already pending")
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._active[key] = job.id
+            self.submitted += 1
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = RUNNING
+        try:
+            job.result = fn(job, *args, **kwargs)
+            status = DONE
+        except Exception as e:
+            print(f"Error in job {job.key}: {str(e)}")
+            job.error = str(e)
+            status = FAILED
+        with self._lock:
+            job.finished_at = time.time()
+            job.status = status
+            if status == DONE:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def _pending(self):
+        return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def _prune(self):
+        cutoff = time.time() - self.result_ttl
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at < cutoff]:
+            job = self._jobs.pop(job_id)
+            if self._active.get(job.key) == job_id:
+                del self._active[job.key]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        """
+        Snapshot of a job for pollers.
+
+        Returns:
+            dict | None: id, status, position (jobs queued ahead of it), partial output,
+                result and error; None when the job is unknown or expired
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            position = 0
+            if job.status == QUEUED:
+                position = sum(
+                    1 for other in self._jobs.values()
+                    if other.status == QUEUED and other.submitted_at < job.submitted_at
+                )
+            return {
+                "id": job.id,
+                "status": job.status,
+                "position": position,
+                "partial": job.partial,
+                "result": job.result,
+                "error": job.error,
+            }
+
+    def get_stats(self):
+        with self._lock:
+            queued = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+            running = sum(1 for job in self._jobs.values() if job.status == RUNNING)
+            return {
+                "workers": self.workers,
+                "queue_depth": queued,
+                "running": running,
+                "max_pending": self.max_pending,
+                "submitted": self.submitted,
+                "deduplicated": self.deduplicated,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """Process-wide job queue"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
+
+__all__ = ['Job', 'JobQueue', 'QueueFullError', 'get_job_queue', 'QUEUED', 'RUNNING', 'DONE', 'FAILED']
@@ -0,0 +1,430 @@
+import os
+import sys
+import shutil
+import hashlib
+import json
+import queue
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from langchain.text_splitter import CharacterTextSplitter
+from langchain_community.vectorstores import FAISS
+from langchain_community.document_loaders import PyPDFLoader
+from dotenv import load_dotenv
+from embedding_cache import CachedEmbeddings, EMBEDDING_BATCH_SIZE
+from llm_clients import get_embeddings_model
+from plan_summaries import summarize_pdf, PLAN_SUMMARY_MODEL
+
+load_dotenv()
+
+# Splitter / embedding settings. Any change here produces a new index version.
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+
+# One PDF directory per product category under KNOWLEDGE_BASE_ROOT,
+# e.g. knowledge_base/child_plans holds the "child" category
+KNOWLEDGE_BASE_ROOT = os.getenv("KNOWLEDGE_BASE_ROOT", "knowledge_base")
+
+# The combined index is saved under KB_CACHE_DIR/index/<version>/
+KB_CACHE_DIR = os.getenv("KB_CACHE_DIR", "kb_cache")
+MANIFEST_FILE = "manifest.json"
+EMBEDDING_CACHE_PATH = os.path.join(KB_CACHE_DIR, "embeddings.sqlite")
+
+# Ingestion pipeline: PDF parsing processes, concurrent embedding requests and
+# the number of chunk batches allowed to wait between the two stages
+INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", str(os.cpu_count() or 1)))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", str(2 * EMBEDDING_CONCURRENCY)))
+
+# Extract structured plan summaries for each PDF while indexing (stored in the manifest)
+PLAN_SUMMARIES = os.getenv("PLAN_SUMMARIES", "1") == "1"
+
+def category_name(directory):
+    """Category stored in chunk metadata, e.g. knowledge_base/savings_plans -> savings"""
+    name = os.path.basename(os.path.normpath(directory))
+    return name[:-len("_plans")] if name.endswith("_plans") else name
+
+def list_categories(root=KNOWLEDGE_BASE_ROOT):
+    """Return {category: directory} for every category directory under root"""
+    if not os.path.isdir(root):
+        return {}
+    return {
+        category_name(name): os.path.join(root, name)
+        for name in sorted(os.listdir(root))
+        if os.path.isdir(os.path.join(root, name))
+    }
+
+def list_pdfs(directory):
+    """Return the sorted list of PDF paths in a knowledge base directory"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.lower().endswith(".pdf")
+    )
+
+def file_hash(path):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def index_version():
+    """
+    Version key for the index format.
+
+    Covers the splitter settings and the embedding model. PDF contents are
+    tracked per file in the manifest, so a changed brochure only re-embeds
+    that file instead of starting a new version.
+    """
+    settings = {
+        "splitter": CharacterTextSplitter.__name__,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "start_index": True,
+        "embedding_model": EMBEDDING_MODEL,
+    }
+    payload = json.dumps(settings, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+def content_version(manifest):
+    """Hash of every file hash in a manifest; changes whenever the index content does"""
+    payload = json.dumps(
+        sorted((path, entry["hash"]) for path, entry in manifest["files"].items())
+    ).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+def get_embeddings():
+    """Process-wide embeddings, backed by the shared on-disk embedding cache"""
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            _embeddings = CachedEmbeddings(
+                get_embeddings_model(EMBEDDING_MODEL),
+                model=EMBEDDING_MODEL,
+                path=EMBEDDING_CACHE_PATH,
+            )
+        return _embeddings
+
+def split_pdf(path, file_digest, category):
+    """
+    Parse and split one PDF.
+
+    Each chunk carries category, source, page and start_index (its character
+    offset in the page) metadata; chunk ids are derived from the category, file name and content hash.
+    """
+    documents = PyPDFLoader(path).load()
+    text_splitter = CharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True)
+    chunks = text_splitter.split_documents(documents)
+    name = os.path.basename(path)
+    for chunk in chunks:
+        chunk.metadata = {
+            "category": category,
+            "source": name,
+            "page": chunk.metadata.get("page", 0),
+            "start_index": chunk.metadata.get("start_index"),
+        }
+    ids = [f"{category}/{name}:{file_digest[:12]}:{i}" for i in range(len(chunks))]
+    return chunks, ids
+
+def create_parse_pool(file_count):
+    """
+    Pool that parses one ingest run's PDFs; the caller shuts it down when the run is done.
+
+    A single PDF is parsed in-process rather than paying for worker processes.
+    Workers are spawned, not forked: ingestion usually runs inside a
+    multi-threaded Streamlit or uvicorn process.
+    """
+    if file_count == 1:
+        return ThreadPoolExecutor(max_workers=1)
+    return ProcessPoolExecutor(
+        max_workers=min(INGEST_PROCESSES, file_count),
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+def ingest_files(files, embeddings, batch_size=EMBEDDING_BATCH_SIZE, concurrency=EMBEDDING_CONCURRENCY):
+    """
+    Parse, split and embed PDFs in a three-stage pipeline.
+
+    PDFs are parsed across a process pool, their chunks stream into a
+    bounded queue in batches, and a pool of threads issues embedding
+    requests concurrently while parsing continues.
+
+    Args:
+        files (dict): name -> (path, content hash, category) of the PDFs to ingest
+        embeddings (CachedEmbeddings): embeddings used for the chunks
+
+    Returns:
+        tuple: (dict of name -> list of (id, text, metadata, vector), embedding stats dict)
+    """
+    results = {name: [] for name in files}
+    stats = {"hits": 0, "misses": 0, "tokens": 0}
+    if not files:
+        return results, stats
+
+    batches = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+    results_lock = threading.Lock()
+    errors = []
+    done = object()
+
+    def embed_worker():
+        while True:
+            batch = batches.get()
+            if batch is done:
+                return
+            if errors:
+                continue
+            try:
+                vectors, batch_stats = embeddings.embed_documents_with_stats([text for _, _, text, _ in batch])
+            except Exception as e:
+                errors.append(e)
+                continue
+            with results_lock:
+                for (name, chunk_id, text, metadata), vector in zip(batch, vectors):
+                    results[name].append((chunk_id, text, metadata, vector))
+                for key, value in batch_stats.items():
+                    stats[key] += value
+
+    workers = [threading.Thread(target=embed_worker, daemon=True) for _ in range(concurrency)]
+    for worker in workers:
+        worker.start()
+
+    pool = create_parse_pool(len(files))
+    try:
+        futures = {
+            pool.submit(split_pdf, path, digest, category): name
+            for name, (path, digest, category) in files.items()
+        }
+        batch = []
+        for future in as_completed(futures):
+            name = futures[future]
+            chunks, ids = future.result()
+            for chunk, chunk_id in zip(chunks, ids):
+                batch.append((name, chunk_id, chunk.page_content, chunk.metadata))
+                if len(batch) >= batch_size:
+                    batches.put(batch)
+                    batch = []
+            if errors:
+                break
+        if batch:
+            batches.put(batch)
+    finally:
+        for _ in workers:
+            batches.put(done)
+        for worker in workers:
+            worker.join()
+        # No idle parser processes outlive the run
+        pool.shutdown(cancel_futures=True)
+
+    if errors:
+        raise errors[0]
+
+    # Workers finish out of order; keep each file's chunks in document order
+    for name in results:
+        results[name].sort(key=lambda record: int(record[0].rsplit(":", 1)[1]))
+    return results, stats
+
+def load_manifest(index_dir):
+    try:
+        with open(os.path.join(index_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"files": {}}
+
+def save_index(knowledge_base, manifest, index_dir):
+    # Write to a temporary directory first so the index and manifest are swapped in together
+    tmp_dir = index_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    knowledge_base.save_local(tmp_dir)
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.replace(tmp_dir, index_dir)
+
+def summarize_plans(knowledge_base, manifest):
+    """
+    Extract plan summaries for every manifest entry that has none yet.
+
+    Entries summarized with another PLAN_SUMMARY_MODEL are redone. A failed
+    extraction leaves the entry without plans, so it is retried next run.
+
+    Returns:
+        int: Number of PDFs summarized
+    """
+    pending = [
+        name for name, entry in manifest["files"].items()
+        if entry["chunk_ids"] and entry.get("summary_model") != PLAN_SUMMARY_MODEL
+    ]
+    if not pending:
+        return 0
+
+    def summarize(name):
+        category = name.split("/", 1)[0]
+        docs = [knowledge_base.docstore.search(chunk_id) for chunk_id in manifest["files"][name]["chunk_ids"]]
+        return summarize_pdf(os.path.basename(name), category, [(doc.page_content, doc.metadata) for doc in docs])
+
+    summarized = 0
+    with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY, thread_name_prefix="summarize") as pool:
+        futures = {pool.submit(summarize, name): name for name in pending}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                plans = future.result()
+            except Exception as e:
+                print(f"Plan summary failed for {name}: {str(e)}")
+                continue
+            manifest["files"][name].update({"plans": plans, "summary_model": PLAN_SUMMARY_MODEL})
+            summarized += 1
+    return summarized
+
+def load_plan_summaries():
+    """Plan summaries stored with the current index version, in manifest order"""
+    manifest = load_manifest(os.path.join(KB_CACHE_DIR, "index", index_version()))
+    return [plan for entry in manifest["files"].values() for plan in entry.get("plans", [])]
+
+def update_knowledge_base(root=KNOWLEDGE_BASE_ROOT):
+    """
+    Bring the combined index for every category under root up to date.
+
+    All categories share one FAISS index; chunks are told apart by their
+    category metadata. The manifest next to the index maps each PDF
+    (category/file.pdf) to its content hash and chunk ids. Only added or
+    changed PDFs are parsed and embedded; vectors for removed or changed
+    PDFs are deleted and everything else is kept. Each manifest entry also
+    holds the structured summaries of the plans in that PDF.
+
+    Returns:
+        tuple: (FAISS index, summary dict of the work done and the resulting index version)
+    """
+    embeddings = get_embeddings()
+    cache_dir = os.path.join(KB_CACHE_DIR, "index")
+    version = index_version()
+    index_dir = os.path.join(cache_dir, version)
+
+    manifest = load_manifest(index_dir)
+    knowledge_base = None
+    if os.path.exists(os.path.join(index_dir, "index.faiss")):
+        # The docstore pickle is written by this process, never downloaded
+        knowledge_base = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+    else:
+        manifest = {"files": {}}
+
+    previous = dict(manifest["files"])
+    current = {
+        f"{category}/{os.path.basename(path)}": (path, file_hash(path), category)
+        for category, directory in list_categories(root).items()
+        for path in list_pdfs(directory)
+    }
+    summary = {
+        "files_skipped": 0,
+        "files_added": 0,
+        "files_changed": 0,
+        "files_removed": 0,
+        "chunks_added": 0,
+        "chunks_removed": 0,
+        "embedding_tokens": 0,
+        "embedding_cache_hits": 0,
+        "plans_summarized": 0,
+    }
+
+    # Drop vectors for removed or changed files
+    stale_ids = []
+    for name, entry in previous.items():
+        if name in current and current[name][1] == entry["hash"]:
+            summary["files_skipped"] += 1
+            continue
+        if name in current:
+            summary["files_changed"] += 1
+        else:
+            summary["files_removed"] += 1
+        stale_ids.extend(entry["chunk_ids"])
+        del manifest["files"][name]
+    if stale_ids and knowledge_base is not None:
+        knowledge_base.delete(stale_ids)
+        summary["chunks_removed"] = len(stale_ids)
+
+    # Parse and embed added or changed files
+    pending = {name: entry for name, entry in current.items() if name not in manifest["files"]}
+    summary["files_added"] = sum(1 for name in pending if name not in previous)
+    ingested, stats = ingest_files(pending, embeddings)
+    for name, (path, digest, category) in pending.items():
+        records = ingested[name]
+        if records:
+            ids = [record[0] for record in records]
+            text_embeddings = [(record[1], record[3]) for record in records]
+            metadatas = [record[2] for record in records]
+            if knowledge_base is None:
+                knowledge_base = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+            else:
+                knowledge_base.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+            summary["chunks_added"] += len(records)
+        manifest["files"][name] = {"hash": digest, "chunk_ids": [record[0] for record in records]}
+    summary["embedding_tokens"] = stats["tokens"]
+    summary["embedding_cache_hits"] = stats["hits"]
+
+    if knowledge_base is None:
+        raise ValueError(f"No PDF content found in {root}")
+
+    if PLAN_SUMMARIES:
+        summary["plans_summarized"] = summarize_plans(knowledge_base, manifest)
+
+    manifest["version"] = content_version(manifest)
+    if any(summary[key] for key in ("files_added", "files_changed", "files_removed", "plans_summarized")):
+        save_index(knowledge_base, manifest, index_dir)
+
+    # Drop indexes built with other splitter / embedding settings
+    for name in os.listdir(cache_dir):
+        if name != version:
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+
+    summary["version"] = f"{version}/{manifest['version']}"
+    print(f"Knowledge base: {summary}")
+    return knowledge_base, summary
+
+def category_positions(knowledge_base):
+    """
+    Index positions of every category's chunks in a combined index.
+
+    Returns:
+        dict: category -> int64 numpy array of FAISS positions
+    """
+    groups = {}
+    for position, doc_id in knowledge_base.index_to_docstore_id.items():
+        document = knowledge_base.docstore.search(doc_id)
+        if document.metadata.get("category"):
+            groups.setdefault(document.metadata["category"], []).append(position)
+    return {category: np.array(positions, dtype=np.int64) for category, positions in groups.items()}
+
+def category_centroids(knowledge_base):
+    """
+    Unit-length mean vector of every category's chunks in a combined index.
+
+    Returns:
+        tuple: (list of category names, numpy array with one centroid per row)
+    """
+    index = knowledge_base.index
+    vectors = index.reconstruct_n(0, index.ntotal)
+    groups = category_positions(knowledge_base)
+    categories = sorted(groups)
+    centroids = np.stack([vectors[groups[category]].mean(axis=0) for category in categories])
+    centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+    return categories, centroids
+
+def load_knowledge_base(root=KNOWLEDGE_BASE_ROOT):
+    """Load the combined FAISS index, re-indexing only what changed"""
+    knowledge_base, _ = update_knowledge_base(root)
+    return knowledge_base
+
+__all__ = ['load_knowledge_base', 'update_knowledge_base', 'load_plan_summaries', 'get_embeddings', 'category_positions', 'category_centroids', 'list_categories', 'index_version']
+
+if __name__ == "__main__":
+    # Re-index every category: python knowledge_base.py [knowledge_base_root]
+    update_knowledge_base(sys.argv[1] if len(sys.argv) > 1 else KNOWLEDGE_BASE_ROOT)
@@ -0,0 +1,118 @@
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from dotenv import load_dotenv
+from streaming import STREAM_TAG
+
+load_dotenv()
+
+# Connection pool and timeouts shared by every OpenAI client in the process
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+_lock = threading.Lock()
+_http_client = None
+_http_async_client = None
+_chat_models = {}
+
+def _limits():
+    return httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_KEEPALIVE)
+
+def _timeout():
+    return httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+def get_http_clients():
+    """Return the process-wide (sync, async) HTTP clients so connections and TLS sessions are reused"""
+    global _http_client, _http_async_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(limits=_limits(), timeout=_timeout())
+            _http_async_client = httpx.AsyncClient(limits=_limits(), timeout=_timeout())
+        return _http_client, _http_async_client
+
+def get_chat_model(model="gpt-4o-mini", temperature=0.7, max_tokens=None, streaming=False):
+    """
+    Return the shared ChatOpenAI client for (model, temperature, max_tokens), creating it once.
+
+    Streaming clients are tagged so their tokens are forwarded to the user
+    (see streaming.TokenStreamHandler); internal calls should not stream.
+    """
+    key = (model, temperature, max_tokens, streaming)
+    chat_model = _chat_models.get(key)
+    if chat_model is not None:
+        return chat_model
+    http_client, http_async_client = get_http_clients()
+    with _lock:
+        if key not in _chat_models:
+            _chat_models[key] = ChatOpenAI(
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                streaming=streaming,
+                # Streamed responses only report token usage when asked to
+                stream_usage=streaming,
+                tags=[STREAM_TAG] if streaming else None,
+                max_retries=LLM_MAX_RETRIES,
+                http_client=http_client,
+                http_async_client=http_async_client,
+            )
+        return _chat_models[key]
+
+def get_embeddings_model(model):
+    http_client, http_async_client = get_http_clients()
+    return OpenAIEmbeddings(
+        model=model,
+        max_retries=LLM_MAX_RETRIES,
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """Count LLM calls and prompt / completion tokens for the runs it is attached to"""
+
+    def __init__(self):
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def on_llm_end(self, response, **kwargs):
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+        if not (prompt_tokens or completion_tokens):
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            prompt_tokens = usage.get("prompt_tokens", 0)
+            completion_tokens = usage.get("completion_tokens", 0)
+        with self._lock:
+            self.llm_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+# Every LLM run started while track_usage() is active reports to its handler
+_usage_handler = ContextVar("llm_usage_handler", default=None)
+register_configure_hook(_usage_handler, inheritable=True)
+
+@contextmanager
+def track_usage():
+    """Count LLM calls and tokens spent inside the with-block (in this thread / context)"""
+    handler = TokenUsageHandler()
+    token = _usage_handler.set(handler)
+    try:
+        yield handler
+    finally:
+        _usage_handler.reset(token)
+
+__all__ = ['get_chat_model', 'get_embeddings_model', 'get_http_clients', 'TokenUsageHandler', 'track_usage']
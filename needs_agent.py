@@ -1,227 +1,308 @@
-def needs_agent(state):
-    import pandas as pd
-    import json
-    from langchain_openai import ChatOpenAI
-    from langchain.chains import LLMChain
-    from langchain.prompts import ChatPromptTemplate
+import json
+from langchain.prompts import ChatPromptTemplate
+from llm_clients import get_chat_model
+from response_store import get_response_store
+from product_catalog import eligible_products, is_simple_profile, format_products, FAST_RECOMMENDATION_MODEL
+
+RECOMMENDATION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are an MB Ageas Life insurance specialist. Your task is to analyze the customer profile and recommend suitable insurance products. Please:
+    1. Focus on the customer's specific needs and circumstances
+    2. Recommend relevant products from the provided product information
+    3. Explain why each product is suitable for their situation
+    4. Present all information in Vietnamese language
+    5. Keep explanations clear and concise"""),
+    ("human", """Customer Profile:
+    Tuổi: {Age}
+    Tình trạng hôn nhân: {MaritalStatus}
+    Có con: {HasChildren}
+    Thu nhập: {Income}
+    Phương thức đóng phí: {PaymentPreference}
+    Nhu cầu bảo hiểm: {InsuranceNeeds}
+    Các vấn đề sức khỏe quan tâm: {HealthConcerns}
+    
+    Product Information:
+    {context}
     
-    def process_multiselect_response(response):
-        """Convert string representation of list back to list if needed"""
-        if isinstance(response, str) and response.startswith('['):
-            try:
-                return json.loads(response)
-            except:
-                return response
-        return response
-
-    questions = [
-        {
-            "question": "How old are you?",
-            "type": "number",
-            "key": "Age",
-            "min_value": 18,
-            "max_value": 100,
-            "step": 1
-        },
-        {
-            "question": "What is your marital status?",
-            "type": "radio",
-            "options": ["Single", "Married"],
-            "key": "MaritalStatus"
-        },
-        {
-            "question": "Do you have children?",
-            "type": "radio",
-            "options": ["Yes", "No"],
-            "key": "HasChildren"
-        },
-        {
-            "question": "What is your monthly income range?",
-            "type": "select",
-            "options": [
-                "Less than 10 million VND",
-                "10-20 million VND",
-                "20-50 million VND",
-                "Above 50 million VND"
-            ],
-            "key": "Income"
-        },
-        {
-            "question": "What is your preferred premium payment method?",
-            "type": "radio",
-            "options": ["One-time payment", "Regular payments"],
-            "key": "PaymentPreference"
-        },
-        {
-            "question": "What are your primary insurance needs?",
-            "type": "multiselect",
-            "options": [
-                "Basic life protection",
-                "Savings and investment",
-                "Children's education fund",
-                "Health protection",
-                "Accident protection",
-                "Critical illness coverage",
-                "Family income protection"
-            ],
-            "key": "InsuranceNeeds"
-        },
-        {
-            "question": "Do you have any specific health concerns?",
-            "type": "multiselect",
-            "options": [
-                "Cancer risks",
-                "Critical illnesses",
-                "Hospital and surgery expenses",
-                "No specific concerns"
-            ],
-            "key": "HealthConcerns"
+    Vui lòng đề xuất các sản phẩm bảo hiểm phù hợp và giải thích lý do lựa chọn:""")
+])
+
+# Graph node that owns the questionnaire while it is in progress (state["active_flow"])
+NEEDS_FLOW = "needs_questionnaire"
+# Sending this input starts the questionnaire over
+NEEDS_AGENT_START = "NEEDS_AGENT_START"
+CANCEL_WORDS = {"cancel", "stop", "quit", "hủy", "dừng"}
+
+def question_prompt(question):
+    """Chat text for one questionnaire question"""
+    if question.get("options"):
+        hint = "Choose several, separated by commas" if question["type"] == "multiselect" else "Choose one"
+        return f"{question['question']}\n\n{hint}: " + ", ".join(question["options"])
+    return question["question"]
+
+recommendation_chain = RECOMMENDATION_PROMPT | get_chat_model("gpt-4", temperature=0, max_tokens=3000, streaming=True)
+fast_recommendation_chain = RECOMMENDATION_PROMPT | get_chat_model(FAST_RECOMMENDATION_MODEL, temperature=0, max_tokens=3000, streaming=True)
+
+# Questionnaire schema; chat answers and batch submissions are both checked against it
+QUESTIONS = [
+    {
+        "question": "How old are you?",
+        "type": "number",
+        "key": "Age",
+        "min_value": 18,
+        "max_value": 100,
+        "step": 1
+    },
+    {
+        "question": "What is your marital status?",
+        "type": "radio",
+        "options": ["Single", "Married"],
+        "key": "MaritalStatus"
+    },
+    {
+        "question": "Do you have children?",
+        "type": "radio",
+        "options": ["Yes", "No"],
+        "key": "HasChildren"
+    },
+    {
+        "question": "What is your monthly income range?",
+        "type": "select",
+        "options": [
+            "Less than 10 million VND",
+            "10-20 million VND",
+            "20-50 million VND",
+            "Above 50 million VND"
+        ],
+        "key": "Income"
+    },
+    {
+        "question": "What is your preferred premium payment method?",
+        "type": "radio",
+        "options": ["One-time payment", "Regular payments"],
+        "key": "PaymentPreference"
+    },
+    {
+        "question": "What are your primary insurance needs?",
+        "type": "multiselect",
+        "options": [
+            "Basic life protection",
+            "Savings and investment",
+            "Children's education fund",
+            "Health protection",
+            "Accident protection",
+            "Critical illness coverage",
+            "Family income protection"
+        ],
+        "key": "InsuranceNeeds"
+    },
+    {
+        "question": "Do you have any specific health concerns?",
+        "type": "multiselect",
+        "options": [
+            "Cancer risks",
+            "Critical illnesses",
+            "Hospital and surgery expenses",
+            "No specific concerns"
+        ],
+        "key": "HealthConcerns"
+    }
+]
+
+def parse_answer(question, value):
+    """
+    Check one answer against its question and return it normalized.
+
+    Numbers must be whole and within min_value/max_value, single choices one
+    of the options and multiselect answers (a list, a JSON list or a comma
+    separated string) a non-empty subset of them. Raises ValueError otherwise.
+    """
+    if question["type"] == "number":
+        try:
+            number = int(str(value).strip())
+        except ValueError:
+            raise ValueError(f"{question['key']}: please enter a whole number")
+        if not question["min_value"] <= number <= question["max_value"]:
+            raise ValueError(f"{question['key']}: must be between {question['min_value']} and {question['max_value']}")
+        return number
+    if question["type"] == "multiselect":
+        if isinstance(value, str):
+            value = value.strip()
+            if value.startswith("["):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    raise ValueError(f"{question['key']}: could not read the selected options")
+            else:
+                value = [part.strip() for part in value.split(",") if part.strip()]
+        choices = list(value or [])
+        invalid = [choice for choice in choices if choice not in question["options"]]
+        if not choices or invalid:
+            raise ValueError(f"{question['key']}: choose one or more of {', '.join(question['options'])}")
+        return choices
+    value = str(value).strip()
+    if value not in question["options"]:
+        raise ValueError(f"{question['key']}: choose one of {', '.join(question['options'])}")
+    return value
+
+def validate_answers(answers):
+    """
+    Check a complete answer set against QUESTIONS.
+
+    Returns:
+        dict: Normalized answers keyed by question key
+
+    Raises:
+        ValueError: Listing every missing or invalid answer
+    """
+    normalized, errors = {}, []
+    for question in QUESTIONS:
+        if answers.get(question["key"]) is None:
+            errors.append(f"{question['key']}: missing")
+            continue
+        try:
+            normalized[question["key"]] = parse_answer(question, answers[question["key"]])
+        except ValueError as e:
+            errors.append(str(e))
+    if errors:
+        raise ValueError("; ".join(errors))
+    return normalized
+
+def generate_recommendations(needs_responses, on_token=None):
+    """Save a completed questionnaire and recommend from the products it is eligible for; on_token receives streamed text"""
+    get_response_store().save(needs_responses)
+    print("Saved responses:", needs_responses)  # Debug print
+
+    # Only products the customer is eligible for go into the prompt
+    needs = list(needs_responses["InsuranceNeeds"]) + list(needs_responses["HealthConcerns"])
+    products = eligible_products(int(needs_responses["Age"]), needs_responses["HasChildren"] == "Yes", needs)
+    chain = fast_recommendation_chain if is_simple_profile(products) else recommendation_chain
+    inputs = {
+        "Age": needs_responses["Age"],
+        "MaritalStatus": needs_responses["MaritalStatus"],
+        "HasChildren": needs_responses["HasChildren"],
+        "Income": needs_responses["Income"],
+        "PaymentPreference": needs_responses["PaymentPreference"],
+        "InsuranceNeeds": needs_responses["InsuranceNeeds"],
+        "HealthConcerns": needs_responses["HealthConcerns"],
+        "context": format_products(products, "vi")
+    }
+    if on_token is None:
+        return chain.invoke(inputs).content
+    parts = []
+    for chunk in chain.stream(inputs):
+        if chunk.content:
+            parts.append(chunk.content)
+            on_token(chunk.content)
+    return "".join(parts)
+
+def completed(needs_responses, on_token=None):
+    """Generate recommendations for a complete answer set and close the flow"""
+    try:
+        print("Generating recommendations with:", needs_responses)  # Debug print
+        recommendations = generate_recommendations(needs_responses, on_token)
+        return {
+            "output": recommendations,
+            "decision": NEEDS_FLOW,
+            "active_flow": None,
+            "needs_step": len(QUESTIONS),
+            "needs_responses": needs_responses,
+            "needs_complete": True,
+            "recommendations_generated": True,
+            "recommendations": recommendations,
+            "current_question": None,
+            "progress": None
+        }
+    except Exception as e:
+        print(f"Error in recommendation generation: {str(e)}")  # Debug print
+        return {
+            "output": f"Xin lỗi, đã có lỗi xảy ra trong quá trình tạo đề xuất: {str(e)}. Vui lòng thử lại sau.",
+            "decision": NEEDS_FLOW,
+            "active_flow": None,
+            "needs_complete": True,
+            "current_question": None,
+            "progress": None
         }
-    ]
 
-    # Initialize or get current state
-    needs_step = state.get("needs_step", 0)
-    needs_responses = state.get("needs_responses", {})
-    welcome_message = "As you want to buy insurance, please answer a few questions so that I can suggest plans suited for you." if needs_step == 0 else ""
-    
-    # If recommendations already generated, return them
-    if state.get("recommendations_generated"):
+def needs_agent(state, finish=completed):
+    """
+    Step-by-step questionnaire for chat: one question per turn, then recommendations.
+
+    finish(needs_responses) produces the final turn; the graph passes one that
+    hands generation to the job queue instead of running it inside the turn.
+    """
+    # A fresh questionnaire starts whenever the flow is entered from the router
+    fresh = state.get("active_flow") != NEEDS_FLOW or state.get("input") == NEEDS_AGENT_START
+    if not fresh and str(state.get("input", "")).strip().lower() in CANCEL_WORDS:
         return {
-            "output": state.get("recommendations", "Assessment complete."),
-            "decision": "needs_agent",
-            "needs_complete": True
+            "output": "The questionnaire has been cancelled. Feel free to ask me anything else.",
+            "decision": NEEDS_FLOW,
+            "active_flow": None,
+            "current_question": None,
+            "progress": None
         }
+    needs_step = 0 if fresh else state.get("needs_step", 0)
+    needs_responses = {} if fresh else dict(state.get("needs_responses") or {})
+    welcome_message = "As you want to buy insurance, please answer a few questions so that I can suggest plans suited for you." if needs_step == 0 else ""
 
     # Process the previous answer if exists
-    if state.get("input") and state.get("input") != "NEEDS_AGENT_START":
+    if not fresh and state.get("input"):
+        question = QUESTIONS[needs_step]
         try:
-            # Process input based on question type
-            if questions[needs_step]["type"] == "multiselect":
-                needs_responses[questions[needs_step]["key"]] = process_multiselect_response(state["input"])
-            else:
-                needs_responses[questions[needs_step]["key"]] = state["input"]
-            
-            print(f"Processed answer for {questions[needs_step]['key']}: {needs_responses[questions[needs_step]['key']]}")  # Debug print
+            needs_responses[question["key"]] = parse_answer(question, state["input"])
+        except ValueError as e:
+            # Ask the same question again
+            welcome_message = f"Sorry, I couldn't use that answer ({str(e)})."
+        else:
+            print(f"Processed answer for {question['key']}: {needs_responses[question['key']]}")  # Debug print
             needs_step += 1
-            
-            # If all questions answered, generate recommendations
-            if needs_step >= len(questions):
-                try:
-                    # Save responses as JSON
-                    with open('insurance_responses.json', 'a') as f:
-                        f.write(json.dumps(needs_responses, ensure_ascii=False) + '\n')
-                    
-                    print("Saved responses:", needs_responses)  # Debug print
-                    
-                    sample_product_info = """
-                    Life Insurance Products:
-                    1. "An Tâm Tài Chính" (Financial Peace of Mind)
-                    - Bảo hiểm tử kỳ với quyền lợi bảo vệ toàn diện
-                    - Sum assured up to 30 times annual income
-                    - Premium options: Monthly, Quarterly, Semi-annual, Annual
-                    - Entry age: 18-65 years
-                    
-                    2. "Phúc Bảo An" (Secure Prosperity)
-                    - Bảo hiểm trọn đời với tích lũy
-                    - Death benefit: 100% sum assured plus accumulated bonuses
-                    - Premium payment term: 10, 15, 20 years
-                    - Entry age: 0-65 years
-                    
-                    Health Insurance Products:
-                    1. "Sống Khỏe" (Healthy Living)
-                    - Bảo hiểm bệnh hiểm nghèo toàn diện
-                    - Covers 45 critical illnesses
-                    - Lump sum payment up to 2 billion VND
-                    - Premium payment term: 10-20 years
-                    
-                    Education Plans:
-                    1. "Học Vấn Tương Lai" (Future Education)
-                    - Kế hoạch giáo dục với quyền lợi bảo vệ
-                    - Guaranteed education fund
-                    - Flexible premium payment terms
-                    - Entry age: 0-15 years
-                    """
-                    
-                    # Generate recommendations using LLM
-                    prompt = ChatPromptTemplate.from_messages([
-                        ("system", """You are an MB Ageas Life insurance specialist. Your task is to analyze the customer profile and recommend suitable insurance products. Please:
-                        1. Focus on the customer's specific needs and circumstances
-                        2. Recommend relevant products from the provided product information
-                        3. Explain why each product is suitable for their situation
-                        4. Present all information in Vietnamese language
-                        5. Keep explanations clear and concise"""),
-                        ("human", """Customer Profile:
-                        Tuổi: {Age}
-                        Tình trạng hôn nhân: {MaritalStatus}
-                        Có con: {HasChildren}
-                        Thu nhập: {Income}
-                        Phương thức đóng phí: {PaymentPreference}
-                        Nhu cầu bảo hiểm: {InsuranceNeeds}
-                        Các vấn đề sức khỏe quan tâm: {HealthConcerns}
-                        
-                        Product Information:
-                        {context}
-                        
-                        Vui lòng đề xuất các sản phẩm bảo hiểm phù hợp và giải thích lý do lựa chọn:""")
-                    ])
-
-                    chain = LLMChain(
-                        llm=ChatOpenAI(
-                            temperature=0,
-                            model="gpt-4",
-                            max_tokens=3000
-                        ),
-                        prompt=prompt
-                    )
-
-                    print("Generating recommendations with:", needs_responses)  # Debug print
-                    recommendations = chain.run(
-                        Age=needs_responses["Age"],
-                        MaritalStatus=needs_responses["MaritalStatus"],
-                        HasChildren=needs_responses["HasChildren"],
-                        Income=needs_responses["Income"],
-                        PaymentPreference=needs_responses["PaymentPreference"],
-                        InsuranceNeeds=needs_responses["InsuranceNeeds"],
-                        HealthConcerns=needs_responses["HealthConcerns"],
-                        context=sample_product_info
-                    )
-                    
-                    return {
-                        "output": recommendations,
-                        "decision": "needs_agent",
-                        "needs_complete": True,
-                        "recommendations_generated": True,
-                        "recommendations": recommendations
-                    }
-                    
-                except Exception as e:
-                    print(f"Error in recommendation generation: {str(e)}")  # Debug print
-                    return {
-                        "output": f"Xin lỗi, đã có lỗi xảy ra trong quá trình tạo đề xuất: {str(e)}. Vui lòng thử lại sau.",
-                        "decision": "needs_agent",
-                        "needs_complete": True
-                    }
-        except Exception as e:
-            print(f"Error processing answer: {str(e)}")  # Debug print
-            return {
-                "output": f"Error processing answer: {str(e)}",
-                "decision": "needs_agent",
-                "needs_step": needs_step
-            }
-
-    # Get current question
-    current_question = questions[needs_step]
-    
-    if not state.get("recommendations_generated"):
-        current_question = questions[needs_step]
+
+        # If all questions answered, generate recommendations
+        if needs_step >= len(QUESTIONS):
+            return finish(needs_responses)
+
+    # Ask the next question; follow-up turns come straight back here until the flow completes
+    current_question = QUESTIONS[needs_step]
+    return {
+        "output": "\n\n".join(part for part in (welcome_message, question_prompt(current_question)) if part),
+        "decision": NEEDS_FLOW,
+        "active_flow": NEEDS_FLOW,
+        "show_form": False,
+        "show_contact_form": False,
+        "needs_step": needs_step,
+        "needs_responses": needs_responses,
+        "needs_complete": False,
+        "recommendations_generated": False,
+        "current_question": current_question,
+        "progress": {
+            "current": needs_step + 1,
+            "total": len(QUESTIONS)
+        }
+    }
+
+def needs_submission(state, finish=completed):
+    """
+    Graph node for a complete answer set submitted at once (state["needs_answers"]).
+
+    finish(needs_responses) produces the answer, as in needs_agent.
+    """
+    answers = state.get("needs_answers") or {}
+    try:
+        needs_responses = validate_answers(answers)
+    except ValueError as e:
         return {
-            "output": welcome_message,
-            "decision": "needs_agent",
-            "needs_step": needs_step,
-            "needs_responses": needs_responses,
-            "current_question": current_question,
-            "progress": {
-                "current": needs_step + 1,
-                "total": len(questions)
-            }
-        }
\ No newline at end of file
+            "output": f"Invalid answers: {str(e)}",
+            "decision": NEEDS_FLOW,
+            "input": "(submitted the needs questionnaire)",
+            "needs_answers": None,
+            "current_question": None,
+            "progress": None
+        }
+    return {
+        "show_contact_form": True,
+        **finish(needs_responses),
+        "input": "(submitted the needs questionnaire)",
+        "needs_answers": None,
+        "show_form": False
+    }
+
+__all__ = ['needs_agent', 'needs_submission', 'completed', 'validate_answers', 'QUESTIONS', 'NEEDS_FLOW', 'NEEDS_AGENT_START']
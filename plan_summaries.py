@@ -0,0 +1,105 @@
+import os
+import re
+from typing import List
+from langchain.prompts import ChatPromptTemplate
+from langchain.pydantic_v1 import BaseModel, Field
+from langchain.schema import Document
+from context_builder import merge_chunks, count_tokens
+from llm_clients import get_chat_model
+
+# Plans are extracted once per PDF at index time with this model; changing it re-extracts every PDF
+PLAN_SUMMARY_MODEL = os.getenv("PLAN_SUMMARY_MODEL", "gpt-4o-mini")
+# Brochure text sent to the extraction call is cut to this many tokens
+PLAN_SUMMARY_MAX_TOKENS = int(os.getenv("PLAN_SUMMARY_MAX_TOKENS", "12000"))
+
+# Questions about every plan (or comparing plans) that are answered from the stored summaries.
+# Overview rules match the whole message and only pure listing requests: a question that names
+# an attribute ("the waiting period for all plans") falls through to retrieval
+_END = r"\s*[.?!]*\s*$"
+OVERVIEW_PATTERNS = [
+    r"^\s*(what|which) (\w+ )?(plans|products|insurance) (do you|does mb ageas) (have|offer|sell)" + _END,
+    r"^\s*((please )?(list|show|summari[sz]e)( me)?|give me)( an?)?( list| overview| summary)?( of)?( all)?( the| your)? (\w+ )?(plans|products)" + _END,
+    r"^\s*(an? )?(list|overview|summary) of( all)?( the| your)? (\w+ )?(plans|products)" + _END,
+    r"^\s*(bên bạn |mb ageas )?có (những|các) (gói|sản phẩm)( bảo hiểm)?( \w+)? nào" + _END,
+    r"^\s*(liệt kê|tổng quan( về)?)( tất cả)?( các| những)? (gói|sản phẩm)( bảo hiểm)?( \w+)?" + _END,
+]
+COMPARISON_PATTERNS = [
+    r"\bcompar(e|ing|ison)\b",
+    r"\b(difference|differences|differ)\b",
+    r"\b(vs\.?|versus)\b",
+    r"\bwhich (plan|product) is (better|cheaper)\b",
+    r"\bso sánh\b",
+    r"\bkhác nhau\b",
+]
+_overview_rules = [re.compile(pattern, re.IGNORECASE) for pattern in OVERVIEW_PATTERNS]
+_comparison_rules = [re.compile(pattern, re.IGNORECASE) for pattern in COMPARISON_PATTERNS]
+
+class PlanSummary(BaseModel):
+    plan_name: str = Field(description="Name of the insurance plan exactly as written in the brochure")
+    key_features: List[str] = Field(description="The main benefits and features, one short phrase each")
+    entry_age: str = Field(description="Entry age range of the insured, e.g. '18-65 years'; 'not stated' if absent")
+    premium_terms: str = Field(description="Premium payment terms and frequencies; 'not stated' if absent")
+    coverage_term: str = Field(description="Policy / coverage term; 'not stated' if absent")
+
+class PlanSummaries(BaseModel):
+    plans: List[PlanSummary] = Field(description="Every distinct insurance plan described in the document")
+
+EXTRACTION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You extract structured facts about MB Ageas insurance plans from brochure text. "
+               "List every distinct plan described; do not invent values that are not in the text."),
+    ("human", "Category: {category}\nDocument: {source}\n\n{text}"),
+])
+extraction_chain = EXTRACTION_PROMPT | get_chat_model(PLAN_SUMMARY_MODEL, temperature=0).with_structured_output(PlanSummaries)
+
+def document_text(chunks):
+    """Rebuild a PDF's text from its (text, metadata) chunks without the overlapping parts"""
+    docs = [Document(page_content=text, metadata=metadata) for text, metadata in chunks]
+    docs.sort(key=lambda doc: (doc.metadata.get("page", 0), doc.metadata.get("start_index") or 0))
+    segments, _ = merge_chunks(docs)
+    return "\n\n".join(segment["text"] for segment in segments)
+
+def summarize_pdf(source, category, chunks):
+    """
+    Extract a structured summary of every plan in one PDF.
+
+    Args:
+        source (str): PDF file name
+        category (str): Product category of the PDF
+        chunks (list): (text, metadata) pairs of the PDF's chunks
+
+    Returns:
+        list: One dict per plan with plan_name, key_features, entry_age,
+              premium_terms, coverage_term, category and source
+    """
+    text = document_text(chunks)
+    if count_tokens(text) > PLAN_SUMMARY_MAX_TOKENS:
+        # Rough cut by characters; brochures state plan facts up front
+        text = text[:PLAN_SUMMARY_MAX_TOKENS * 3]
+    result = extraction_chain.invoke({"category": category, "source": source, "text": text})
+    return [{**plan.dict(), "category": category, "source": source} for plan in result.plans]
+
+def is_overview_query(query):
+    return any(rule.search(query) for rule in _overview_rules)
+
+def is_comparison_query(query):
+    return any(rule.search(query) for rule in _comparison_rules)
+
+def format_plan(plan):
+    lines = [f"**{plan['plan_name']}** ({plan['category']})"]
+    lines += [f"- {feature}" for feature in plan["key_features"]]
+    lines.append(f"- Entry age: {plan['entry_age']}")
+    lines.append(f"- Premium terms: {plan['premium_terms']}")
+    lines.append(f"- Coverage term: {plan['coverage_term']}")
+    return "\n".join(lines)
+
+def format_plans(plans):
+    """Render plan summaries as markdown, grouped by category"""
+    sections = {}
+    for plan in plans:
+        sections.setdefault(plan["category"], []).append(format_plan(plan))
+    return "\n\n".join(
+        f"### {category.capitalize()} plans\n\n" + "\n\n".join(entries)
+        for category, entries in sections.items()
+    )
+
+__all__ = ['summarize_pdf', 'is_overview_query', 'is_comparison_query', 'format_plans', 'PLAN_SUMMARY_MODEL']
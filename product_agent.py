@@ -1,107 +1,461 @@
 import os
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import DirectoryLoader, PyPDFLoader
-from langchain.chains import LLMChain
+import re
+import time
+import random
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+from typing import List, Optional
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain.pydantic_v1 import BaseModel, Field
 from langchain.schema.runnable import RunnablePassthrough
-from langchain.tools import Tool
+from langchain.tools import StructuredTool
 from langchain.agents import AgentExecutor, create_openai_functions_agent
 from dotenv import load_dotenv
+import faiss
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from knowledge_base import update_knowledge_base, list_categories, get_embeddings, category_positions, category_centroids, load_plan_summaries
+from plan_summaries import is_overview_query, is_comparison_query, format_plans
+from semantic_cache import SemanticCache
+from context_builder import build_context, format_segments, ContextStats, CONTEXT_TOKEN_BUDGET, MMR_FETCH_K, MMR_K, MMR_LAMBDA
+from llm_clients import get_chat_model, track_usage
+from conversation_memory import memory_context, NO_HISTORY
 
 load_dotenv()
 
-def load_knowledge_base(directory):
-    loader = DirectoryLoader(directory, glob="*.pdf", loader_cls=PyPDFLoader)
-    documents = loader.load()
-    text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    texts = text_splitter.split_documents(documents)
-    embeddings = OpenAIEmbeddings()
-    return FAISS.from_documents(texts, embeddings)
+# Product categories in the combined index (one per knowledge_base/<category>_plans directory)
+CATEGORIES = list(list_categories()) or ["retirement", "savings", "illness", "accident", "child"]
 
-# Setup knowledge bases
-mb_ageas_retirement = load_knowledge_base("knowledge_base/retirement_plans")
-mb_ageas_saving = load_knowledge_base("knowledge_base/savings_plans")
-mb_ageas_illness = load_knowledge_base("knowledge_base/illness_plans")
-mb_ageas_accident = load_knowledge_base("knowledge_base/accident_plans")
-mb_ageas_child = load_knowledge_base("knowledge_base/child_plans")
+# Set KB_WARMUP=1 to pre-load the knowledge base in a background thread
+KB_WARMUP = os.getenv("KB_WARMUP", "0") == "1"
 
-llm = ChatOpenAI(temperature=0)
+# "agent": OpenAI-functions agent choosing tool calls (default)
+# "fanout": one planning call, parallel per-category retrieval, one answer call
+# "single": categories picked by centroid similarity, exactly one LLM call
+# "ab": each question is answered by a random mode from PRODUCT_AGENT_AB_MODES
+PRODUCT_AGENT_MODE = os.getenv("PRODUCT_AGENT_MODE", "agent")
+PRODUCT_AGENT_AB_MODES = os.getenv("PRODUCT_AGENT_AB_MODES", "agent,single").split(",")
+FANOUT_K_PER_CATEGORY = int(os.getenv("FANOUT_K_PER_CATEGORY", "6"))
+# Single mode searches every category scoring within this margin of the best one, up to the max
+SINGLE_CATEGORY_MARGIN = float(os.getenv("SINGLE_CATEGORY_MARGIN", "0.02"))
+SINGLE_MAX_CATEGORIES = int(os.getenv("SINGLE_MAX_CATEGORIES", "3"))
+SINGLE_K = int(os.getenv("SINGLE_K", "10"))
 
-def run_qa(query, knowledge_base) -> str:
-    query_text = query if isinstance(query, str) else query.get('query', '')
-    docs = knowledge_base.similarity_search(query_text, k=10)
-    context = "\n".join([doc.page_content for doc in docs])
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are an AI assistant specializing in insurance plans.  Provide a comprehensive summary of ALL different insurance plans mentioned in the context. Focus on key features and differences between plans. If only one plan is mentioned, state that clearly."),
-        ("human", "Context: {context}\n\nQuery: {query}\n\nProvide a summary of the insurance plans mentioned:"),
-    ])
-    chain = LLMChain(llm=llm, prompt=prompt)
-    return chain.run(context=context, query=query_text)
+# Words naming each category in a question (English and Vietnamese), for overview and comparison queries
+CATEGORY_KEYWORDS = {
+    "retirement": r"\b(retirement|pension|hưu trí)\b",
+    "savings": r"\b(savings?|tiết kiệm)\b",
+    "illness": r"\b(illness|critical|health|bệnh)\b",
+    "accident": r"\b(accident|tai nạn)\b",
+    "child": r"\b(child|children|kids?|education|con|trẻ em|giáo dục)\b",
+}
+
+# The combined index is loaded on first use, once per process
+_knowledge_base = None
+_knowledge_base_version = None
+_plan_summaries = []
+_knowledge_base_lock = threading.RLock()
+
+# Answers to recent product questions, scoped to the index version they came from
+response_cache = SemanticCache()
+
+def get_knowledge_base():
+    """Return the combined index, loading it on first use (thread-safe)"""
+    if _knowledge_base is not None:
+        return _knowledge_base
+    with _knowledge_base_lock:
+        if _knowledge_base is None:
+            reload_knowledge_base()
+        return _knowledge_base
+
+def reload_knowledge_base():
+    """Re-index changed PDFs and swap in the new index, invalidating cached answers"""
+    global _knowledge_base, _knowledge_base_version, _plan_summaries
+    with _knowledge_base_lock:
+        knowledge_base, summary = update_knowledge_base()
+        if summary["version"] != _knowledge_base_version:
+            response_cache.invalidate(summary["version"])
+        _plan_summaries = load_plan_summaries()
+        _knowledge_base, _knowledge_base_version = knowledge_base, summary["version"]
+        return summary
+
+def get_knowledge_base_version():
+    get_knowledge_base()
+    return _knowledge_base_version
+
+def get_plan_summaries():
+    """Structured plan summaries extracted when the current index was built"""
+    get_knowledge_base()
+    return _plan_summaries
+
+_centroids = {}
+
+def get_category_centroids():
+    """Category centroids of the current index, computed once per index version"""
+    version = get_knowledge_base_version()
+    if _centroids.get("version") != version:
+        categories, centroids = category_centroids(get_knowledge_base())
+        _centroids.update({"version": version, "categories": categories, "centroids": centroids})
+    return _centroids["categories"], _centroids["centroids"]
+
+_positions = {}
+
+def get_category_positions():
+    """FAISS positions of each category's chunks in the current index, computed once per index version"""
+    version = get_knowledge_base_version()
+    if _positions.get("version") != version:
+        _positions.update({"version": version, "positions": category_positions(get_knowledge_base())})
+    return _positions["positions"]
+
+def warm_up_knowledge_base():
+    try:
+        get_knowledge_base()
+    except Exception as e:
+        print(f"Knowledge base warm-up failed: {str(e)}")
+
+def start_warmup():
+    thread = threading.Thread(target=warm_up_knowledge_base, name="kb-warmup", daemon=True)
+    thread.start()
+    return thread
+
+# Follow-up questions that lean on earlier turns ("what about its premium?") bypass the answer cache
+FOLLOW_UP_PATTERN = re.compile(r"\b(it|its|this|that|these|those|they|them|their|same|nó|đó|này|ấy)\b", re.IGNORECASE)
+
+def is_follow_up(query, history):
+    return history != NO_HISTORY and bool(FOLLOW_UP_PATTERN.search(query))
 
-def run_mb_ageas_retirement_plan_qa(query) -> str:
-    return run_qa(query, mb_ageas_retirement)
+# Kept/dropped chunk and token counts of every assembled context
+context_stats = ContextStats()
 
-def run_mb_ageas_saving_plan_qa(query) -> str:
-    return run_qa(query, mb_ageas_saving)
+def search_chunks(query_vector, categories=None, k=MMR_K):
+    """
+    Diverse top chunks for a query (MMR), optionally restricted to categories.
 
-def run_mb_ageas_illness_plan_qa(query) -> str:
-    return run_qa(query, mb_ageas_illness)
+    The MMR_FETCH_K nearest candidates are taken inside the categories by an
+    id selector in the FAISS search itself (filtering after a whole-index
+    search could leave a category short), then MMR picks k among them.
+    """
+    knowledge_base = get_knowledge_base()
+    fetch_k = max(MMR_FETCH_K, 2 * k)
+    params = None
+    if categories:
+        positions = get_category_positions()
+        selected = [positions[category] for category in categories if category in positions]
+        if not selected:
+            return []
+        params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(np.concatenate(selected)))
+    query = np.array([query_vector], dtype=np.float32)
+    _, found = knowledge_base.index.search(query, fetch_k, params=params)
+    candidates = [int(position) for position in found[0] if position != -1]
+    if not candidates:
+        return []
+    vectors = [knowledge_base.index.reconstruct(position) for position in candidates]
+    chosen = maximal_marginal_relevance(query[0], vectors, k=min(k, len(candidates)), lambda_mult=MMR_LAMBDA)
+    return [knowledge_base.docstore.search(knowledge_base.index_to_docstore_id[candidates[i]]) for i in chosen]
 
-def run_mb_ageas_accident_plan_qa(query) -> str:
-    return run_qa(query, mb_ageas_accident)
+def assemble_context(docs, group_by_category=False, budget=CONTEXT_TOKEN_BUDGET):
+    """Merge, deduplicate and pack retrieved chunks into the prompt token budget"""
+    segments, stats = build_context(docs, budget)
+    context_stats.record(stats)
+    print(f"Context: {stats['segments_kept']} segments / {stats['tokens_kept']} tokens kept "
+          f"from {stats['chunks_retrieved']} chunks / {stats['raw_tokens']} tokens")
+    return format_segments(segments, group_by_category)
 
-def run_mb_ageas_child_plan_qa(query) -> str:
-    return run_qa(query, mb_ageas_child)
+def normalize_categories(categories):
+    """Accept one category, several categories or none; drop unknown names"""
+    if not categories:
+        return []
+    if isinstance(categories, str):
+        categories = [categories]
+    return [category for category in categories if category in CATEGORIES]
+
+llm = get_chat_model("gpt-3.5-turbo", temperature=0)
+
+QA_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are an AI assistant specializing in insurance plans.  Provide a comprehensive summary of ALL different insurance plans mentioned in the context. Focus on key features and differences between plans. If only one plan is mentioned, state that clearly."),
+    ("human", "Context: {context}\n\nQuery: {query}\n\nProvide a summary of the insurance plans mentioned:"),
+])
+qa_chain = QA_PROMPT | llm
+
+def run_qa(query, categories=None) -> str:
+    """
+    Answer a product question from the combined index.
+
+    Args:
+        query (str | dict): The question, or a dict with a 'query' key
+        categories (str | list | None): Restrict the search to these categories; None searches all
+    """
+    query_text = query if isinstance(query, str) else query.get('query', '')
+    categories = normalize_categories(categories)
+    version = get_knowledge_base_version()
+    namespace = "qa:" + ",".join(sorted(categories))
+    query_vector = get_embeddings().embed_query(query_text)
+    cached = response_cache.get(query_vector, namespace, version)
+    if cached is not None:
+        return cached
+
+    context = assemble_context(search_chunks(query_vector, categories))
+    answer = qa_chain.invoke({"context": context, "query": query_text}).content
+    response_cache.put(query_vector, namespace, version, answer)
+    return answer
+
+class PlanQAInput(BaseModel):
+    query: str = Field(description="The customer's question about MB Ageas insurance plans")
+    categories: Optional[List[str]] = Field(
+        default=None,
+        description=f"Plan categories to search, any of: {', '.join(CATEGORIES)}. "
+                    "Pass several to compare categories; leave empty to search all plans."
+    )
+
+def run_mb_ageas_plan_qa(query: str, categories: Optional[List[str]] = None) -> str:
+    return run_qa(query, categories)
 
 tools = [
-    Tool(
-        name="MBagaesRetirementPlanQA",
-        func=run_mb_ageas_retirement_plan_qa,
-        description="Useful for answering questions about MB Ageas retirement insurance plans."
-    ),
-    Tool(
-        name="MBagaesSavingsPlanQA",
-        func=run_mb_ageas_saving_plan_qa,
-        description="Useful for answering questions about MB Ageas savings insurance plans."
-    ),
-    Tool(
-        name="MBagaesIllnessPlanQA",
-        func=run_mb_ageas_illness_plan_qa,
-        description="Useful for answering questions about MB Ageas illness insurance plans.."
-    ),
-    Tool(
-        name="MBagaesAccidentPlanQA",
-        func=run_mb_ageas_accident_plan_qa,
-        description="Useful for answering questions about MB Ageas accident plans."
-    ),
-    Tool(
-        name="MBagaesChildPlanQA",
-        func=run_mb_ageas_child_plan_qa,
-        description="Useful for answering questions about MB Ageas child plans."
+    StructuredTool.from_function(
+        func=run_mb_ageas_plan_qa,
+        name="MBageasPlanQA",
+        description="Useful for answering questions about MB Ageas insurance plans "
+                    f"({', '.join(CATEGORIES)}), including comparisons across categories in a single call.",
+        args_schema=PlanQAInput
     ),
 ]
 
 # Update the agent prompt
 agent_prompt = ChatPromptTemplate.from_messages([
     ("system", "You are an AI assistant specializing in insurance products. "
-               "Use the provided tools to answer questions about child and retirement insurance plans. "
+               "Use the provided tool to answer questions about MB Ageas insurance plans; "
+               "search several categories in one call when comparing plans. "
                "Always provide a final, concise summary of the plans discussed, even if you've used multiple tools."
                "Do not provide the same response again & again. Always answer in English Language."),
+    ("system", "Earlier in this conversation:\n{history}"),
     ("human", "{input}"),
     MessagesPlaceholder(variable_name="agent_scratchpad"),
     ("human", "Summarize the key points about the insurance plans discussed in your response. If you've used multiple tools, consolidate the information into a single, coherent answer.")
 ])
 
-# Create the agent
-agent = create_openai_functions_agent(llm=llm, tools=tools, prompt=agent_prompt)
+# Create the agent; only its final consolidated answer is streamed to the user
+agent_llm = get_chat_model("gpt-3.5-turbo", temperature=0, streaming=True)
+agent = create_openai_functions_agent(llm=agent_llm, tools=tools, prompt=agent_prompt)
 
 # Create the agent executor with a max_iterations limit
 agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True, max_iterations=3)
 
 # Combine runnables
-product_agent = RunnablePassthrough() | agent_executor
+product_agent_executor = RunnablePassthrough() | agent_executor
+
+def agent_answer(state):
+    """Answer product questions through the agent, reusing answers to near-identical questions"""
+    query = state["input"]
+    history = state.get("history", NO_HISTORY)
+    use_cache = not is_follow_up(query, history)
+    version = get_knowledge_base_version()
+    # Scoped by the plans the question names, so near-identical questions about different plans never share an answer
+    namespace = "agent:" + ",".join(mentioned_categories(query))
+    query_vector = get_embeddings().embed_query(query)
+    cached = response_cache.get(query_vector, namespace, version) if use_cache else None
+    if cached is not None:
+        return {"output": cached}
+
+    response = product_agent_executor.invoke({"input": query, "history": history})
+    if use_cache:
+        response_cache.put(query_vector, namespace, version, response["output"])
+    return {"output": response["output"]}
+
+PLANNER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You select which MB Ageas insurance plan categories are needed to answer a customer question. "
+               "The categories are: {categories}. "
+               "Respond with only the relevant category names separated by commas, or 'all' if every category may be relevant."),
+    ("human", "{query}"),
+])
+planner_chain = PLANNER_PROMPT | get_chat_model("gpt-4o-mini", temperature=0)
+
+FANOUT_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are an AI assistant specializing in insurance products. "
+               "Answer the customer's question using the context, which is grouped by plan category. "
+               "Provide a final, concise summary of the plans discussed, focusing on key features and the differences between plans. "
+               "If several categories are involved, consolidate them into a single, coherent answer. Always answer in English Language."),
+    ("human", "Earlier in this conversation:\n{history}\n\nContext:\n{context}\n\nQuestion: {query}"),
+])
+fanout_chain = FANOUT_PROMPT | agent_llm
+
+# Shared by every request; one retrieval per category runs at a time per worker
+_retrieval_pool = ThreadPoolExecutor(max_workers=max(2, len(CATEGORIES)), thread_name_prefix="retrieval")
+
+def plan_categories(query):
+    """Pick every category relevant to the question in one planning call"""
+    answer = planner_chain.invoke({"query": query, "categories": ", ".join(CATEGORIES)}).content.lower()
+    categories = [category for category in CATEGORIES if category in answer]
+    return categories or list(CATEGORIES)
+
+def retrieve_category(query_vector, category, k=FANOUT_K_PER_CATEGORY):
+    return search_chunks(query_vector, [category], k=k)
+
+def fanout_answer(query, history=NO_HISTORY):
+    """
+    Answer a product question with one planning call, parallel retrieval and one answer call.
+
+    The query embedding runs alongside the planning call, and each selected
+    category is searched concurrently before a single summarization.
+    """
+    version = get_knowledge_base_version()
+    vector_future = _retrieval_pool.submit(get_embeddings().embed_query, query)
+    categories = plan_categories(query)
+    query_vector = vector_future.result()
+
+    namespace = "fanout:" + ",".join(categories)
+    use_cache = not is_follow_up(query, history)
+    cached = response_cache.get(query_vector, namespace, version) if use_cache else None
+    if cached is not None:
+        return cached
+
+    futures = {category: _retrieval_pool.submit(retrieve_category, query_vector, category) for category in categories}
+    results = [future.result() for future in futures.values()]
+    # Interleave per-category results so the token budget is shared fairly between categories
+    docs = [doc for rank in zip_longest(*results) for doc in rank if doc is not None]
+    print(f"Fan-out retrieval over {categories}")
+
+    context = assemble_context(docs, group_by_category=True)
+    answer = fanout_chain.invoke({"context": context, "query": query, "history": history}).content
+    if use_cache:
+        response_cache.put(query_vector, namespace, version, answer)
+    return answer
+
+def score_categories(query_vector):
+    """Categories whose centroid is closest to the query, best first"""
+    categories, centroids = get_category_centroids()
+    vector = np.asarray(query_vector, dtype=np.float32)
+    scores = centroids @ (vector / np.linalg.norm(vector))
+    ranked = np.argsort(scores)[::-1][:SINGLE_MAX_CATEGORIES]
+    best = scores[ranked[0]]
+    return [categories[i] for i in ranked if scores[i] >= best - SINGLE_CATEGORY_MARGIN]
+
+def single_call_answer(query, history=NO_HISTORY):
+    """
+    Answer a product question with exactly one LLM call.
+
+    The query is embedded once; that vector picks the categories by centroid
+    similarity and pulls the top chunks from them before a single answer call.
+    """
+    version = get_knowledge_base_version()
+    query_vector = get_embeddings().embed_query(query)
+    categories = score_categories(query_vector)
+
+    namespace = "single:" + ",".join(sorted(categories))
+    use_cache = not is_follow_up(query, history)
+    cached = response_cache.get(query_vector, namespace, version) if use_cache else None
+    if cached is not None:
+        return cached
+
+    context = assemble_context(search_chunks(query_vector, categories, k=SINGLE_K), group_by_category=True)
+    print(f"Single-call retrieval over {categories}")
+
+    answer = fanout_chain.invoke({"context": context, "query": query, "history": history}).content
+    if use_cache:
+        response_cache.put(query_vector, namespace, version, answer)
+    return answer
+
+def mentioned_categories(query):
+    return [
+        category for category, pattern in CATEGORY_KEYWORDS.items()
+        if category in CATEGORIES and re.search(pattern, query, re.IGNORECASE)
+    ]
+
+def summary_answer(query, history=NO_HISTORY):
+    """
+    Answer an overview or comparison question from the stored plan summaries.
+
+    Overviews are rendered directly with no LLM call; comparisons make one
+    call over the summaries instead of retrieved brochure chunks. Returns
+    None when no stored plan matches the question.
+    """
+    categories = mentioned_categories(query)
+    plans = [plan for plan in get_plan_summaries() if not categories or plan["category"] in categories]
+    if not plans:
+        return None
+    if not is_comparison_query(query):
+        return format_plans(plans)
+
+    version = get_knowledge_base_version()
+    query_vector = get_embeddings().embed_query(query)
+    namespace = "summaries:" + ",".join(categories)
+    use_cache = not is_follow_up(query, history)
+    cached = response_cache.get(query_vector, namespace, version) if use_cache else None
+    if cached is not None:
+        return cached
+    answer = fanout_chain.invoke({"context": format_plans(plans), "query": query, "history": history}).content
+    if use_cache:
+        response_cache.put(query_vector, namespace, version, answer)
+    return answer
+
+PRODUCT_AGENT_MODES = {
+    "agent": lambda query, history: agent_answer({"input": query, "history": history})["output"],
+    "fanout": fanout_answer,
+    "single": single_call_answer,
+}
+
+# Latency and token usage per mode, for comparing modes side by side
+_ab_lock = threading.Lock()
+ab_stats = {}
+
+def record_mode_run(mode, seconds, usage):
+    with _ab_lock:
+        stats = ab_stats.setdefault(mode, {
+            "runs": 0, "cache_hits": 0, "seconds": 0.0,
+            "llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+        })
+        if usage.llm_calls == 0:
+            stats["cache_hits"] += 1
+            return
+        stats["runs"] += 1
+        stats["seconds"] += seconds
+        stats["llm_calls"] += usage.llm_calls
+        stats["prompt_tokens"] += usage.prompt_tokens
+        stats["completion_tokens"] += usage.completion_tokens
+    print(f"Product agent [{mode}]: {seconds:.2f}s, {usage.llm_calls} LLM calls, "
+          f"{usage.prompt_tokens} prompt / {usage.completion_tokens} completion tokens")
+
+def ab_report():
+    """Average latency, LLM calls and tokens per uncached answer for each mode"""
+    with _ab_lock:
+        return {
+            mode: {
+                "runs": stats["runs"],
+                "cache_hits": stats["cache_hits"],
+                **{
+                    f"avg_{key}": stats[key] / stats["runs"] if stats["runs"] else 0
+                    for key in ("seconds", "llm_calls", "prompt_tokens", "completion_tokens")
+                },
+            }
+            for mode, stats in ab_stats.items()
+        }
+
+def product_agent(state):
+    """Answer product questions in the configured PRODUCT_AGENT_MODE"""
+    mode = PRODUCT_AGENT_MODE
+    if mode == "ab":
+        mode = random.choice(PRODUCT_AGENT_AB_MODES)
+    if mode not in PRODUCT_AGENT_MODES:
+        mode = "agent"
+    query = state["input"]
+    history = memory_context(state.get("memory"), "product_agent")
+
+    started = time.perf_counter()
+    with track_usage() as usage:
+        output = None
+        # Overview and comparison questions are served from the plan summaries;
+        # detailed follow-ups go to live retrieval
+        if is_overview_query(query) or is_comparison_query(query):
+            output = summary_answer(query, history)
+            if output is not None:
+                mode = "summaries"
+        if output is None:
+            output = PRODUCT_AGENT_MODES[mode](query, history)
+    record_mode_run(mode, time.perf_counter() - started, usage)
+    return {"output": output}
+
+if KB_WARMUP:
+    start_warmup()
 
 # def test_product_agent():
 #     while True:
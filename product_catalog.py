@@ -0,0 +1,88 @@
+import os
+import json
+import hashlib
+import threading
+
+# Structured product catalog: entry ages, payment terms, categories and the needs each product covers
+PRODUCT_CATALOG_PATH = os.getenv("PRODUCT_CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "product_catalog.json"))
+
+# Profiles eligible for at most this many products are answered by the faster model
+SIMPLE_PROFILE_MAX_PRODUCTS = int(os.getenv("SIMPLE_PROFILE_MAX_PRODUCTS", "2"))
+FAST_RECOMMENDATION_MODEL = os.getenv("FAST_RECOMMENDATION_MODEL", "gpt-4o-mini")
+
+_catalog = None
+_catalog_version = None
+_catalog_lock = threading.Lock()
+
+def load_catalog():
+    """Return the list of catalog products, reading the file once per process"""
+    global _catalog, _catalog_version
+    with _catalog_lock:
+        if _catalog is None:
+            with open(PRODUCT_CATALOG_PATH, "rb") as f:
+                payload = f.read()
+            _catalog = json.loads(payload)["products"]
+            _catalog_version = hashlib.sha256(payload).hexdigest()[:16]
+        return _catalog
+
+def catalog_version():
+    """Hash of the catalog file; changes whenever any product does"""
+    load_catalog()
+    return _catalog_version
+
+def is_eligible(product, age, has_children):
+    if product["insured"] == "child":
+        # Children's ages are not asked, so any parent qualifies for children's plans
+        return bool(has_children)
+    entry_age = product.get("entry_age")
+    return entry_age is None or entry_age["min"] <= age <= entry_age["max"]
+
+def eligible_products(age, has_children, needs=None):
+    """
+    Filter the catalog down to the products a profile can buy.
+
+    Args:
+        age (int): Age of the policyholder
+        has_children (bool): Whether the customer has children
+        needs (list | None): Needs or concerns the customer selected; when
+            any product covers one of them, products covering none are dropped
+
+    Returns:
+        list: Eligible product dicts in catalog order
+    """
+    products = [product for product in load_catalog() if is_eligible(product, age, has_children)]
+    if needs:
+        matching = [product for product in products if set(product["needs"]) & set(needs)]
+        if matching:
+            return matching
+    return products
+
+def is_simple_profile(products):
+    return len(products) <= SIMPLE_PROFILE_MAX_PRODUCTS
+
+def format_product(product, number, language="en"):
+    lines = [f'{number}. "{product["name"]}" ({product["english_name"]})', f'- {product["description"][language]}']
+    lines += [f"- {feature}" for feature in product["features"]]
+    if product.get("premium_frequencies"):
+        lines.append(f"- Premium options: {', '.join(product['premium_frequencies'])}")
+    if product.get("payment_terms"):
+        lines.append(f"- Premium payment term: {product['payment_terms']}")
+    if product.get("entry_age"):
+        insured = " for children" if product["insured"] == "child" else ""
+        lines.append(f"- Entry age: {product['entry_age']['min']}-{product['entry_age']['max']} years{insured}")
+    return "\n".join(lines)
+
+def format_products(products, language="en"):
+    """Render products as prompt text, numbered within each catalog category"""
+    if not products:
+        return "No products match this profile."
+    sections = {}
+    for product in products:
+        sections.setdefault(product["category"], []).append(product)
+    return "\n\n".join(
+        f"{category}:\n" + "\n\n".join(format_product(product, i, language) for i, product in enumerate(items, 1))
+        for category, items in sections.items()
+    )
+
+__all__ = ['load_catalog', 'catalog_version', 'eligible_products', 'is_simple_profile', 'format_products',
+           'FAST_RECOMMENDATION_MODEL']
@@ -0,0 +1,169 @@
+import sys
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from langchain.prompts import ChatPromptTemplate
+from llm_clients import get_chat_model
+from streaming import stream_chain, record_ttft
+from recommendation_table import RecommendationTable, profile_bucket, all_buckets, bucket_key, UNKNOWN_CHILDREN
+from product_catalog import catalog_version as product_catalog_version, eligible_products, is_simple_profile, format_products, FAST_RECOMMENDATION_MODEL
+
+RECOMMENDATION_SYSTEM_PROMPT = """You are an MB Ageas Life insurance specialist. Analyze the customer profile and recommend suitable insurance products. Follow these guidelines:
+
+    1. Focus on the customer's specific life situation and needs
+    2. Recommend 2-3 most relevant products from the provided options
+    3. Explain why each recommended product suits their situation
+    4. Present all information in Vietnamese
+    5. Keep explanations clear and concise
+    6. End with a call to action to schedule a consultation
+
+    Format your response with clear sections:
+    - Brief profile summary
+    - Product recommendations with explanations
+    - Next steps"""
+
+# Customer profile wording for the English (app.py) and Vietnamese (app_v.py) front ends
+RECOMMENDATION_PROMPTS = {
+    "en": ChatPromptTemplate.from_messages([
+        ("system", RECOMMENDATION_SYSTEM_PROMPT),
+        ("human", """Customer Profile:
+    Age: {age}
+    Marital status: {marital_status}
+    Have children: {has_children}
+    Number of children: {num_children}
+
+    Available Products:
+    {products}
+
+    Please provide personalized recommendations in Vietnamese:""")
+    ]),
+    "vi": ChatPromptTemplate.from_messages([
+        ("system", RECOMMENDATION_SYSTEM_PROMPT),
+        ("human", """Customer Profile:
+    Tuổi: {age}
+    Tình trạng hôn nhân: {marital_status}
+    Có con: {has_children}
+    Số con: {num_children}
+
+    Available Products:
+    {products}
+
+    Please provide personalized recommendations in Vietnamese:""")
+    ]),
+}
+
+PROFILE_VALUES = {
+    "en": {"married": "Married", "single": "Single", "yes": "Yes", "no": "No", UNKNOWN_CHILDREN: "Not specified"},
+    "vi": {"married": "Đã kết hôn", "single": "Độc thân", "yes": "Có", "no": "Không", UNKNOWN_CHILDREN: "Chưa rõ"},
+}
+
+RECOMMENDATION_MODEL = "gpt-4"
+recommendation_model = get_chat_model(RECOMMENDATION_MODEL, temperature=0.7, max_tokens=2000, streaming=True)
+recommendation_chains = {
+    language: prompt | recommendation_model
+    for language, prompt in RECOMMENDATION_PROMPTS.items()
+}
+# Profiles eligible for only a few products don't need GPT-4
+fast_recommendation_model = get_chat_model(FAST_RECOMMENDATION_MODEL, temperature=0.7, max_tokens=2000, streaming=True)
+fast_recommendation_chains = {
+    language: prompt | fast_recommendation_model
+    for language, prompt in RECOMMENDATION_PROMPTS.items()
+}
+
+# Recommendations are generated once per profile bucket and catalog version
+recommendation_table = RecommendationTable()
+
+def catalog_version():
+    """Hash of everything a stored recommendation depends on: product catalog, prompts and models"""
+    payload = json.dumps({
+        "catalog": product_catalog_version(),
+        "prompts": {language: prompt.pretty_repr() for language, prompt in RECOMMENDATION_PROMPTS.items()},
+        "values": PROFILE_VALUES,
+        "models": [RECOMMENDATION_MODEL, FAST_RECOMMENDATION_MODEL],
+    }, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+CATALOG_VERSION = catalog_version()
+
+def profile_products(form_data):
+    """Catalog products the profile is eligible for; a bucket's age range is checked by its lower bound"""
+    age = int(str(form_data["age"]).split("-")[0])
+    return eligible_products(age, form_data["has_children"])
+
+def recommendation_inputs(form_data, language="en"):
+    """Build the recommendation prompt inputs from user form data"""
+    values = PROFILE_VALUES[language]
+    return {
+        "age": form_data["age"],
+        "marital_status": values["married"] if form_data["is_married"] else values["single"],
+        "has_children": values["yes"] if form_data["has_children"] else values["no"],
+        "num_children": values.get(form_data["num_children"], form_data["num_children"]),
+        "products": format_products(profile_products(form_data))
+    }
+
+def recommendation_chain(form_data, language="en"):
+    """The faster model for profiles with few eligible products, GPT-4 otherwise"""
+    chains = fast_recommendation_chains if is_simple_profile(profile_products(form_data)) else recommendation_chains
+    return chains[language]
+
+def lookup_recommendation(form_data, language="en"):
+    """
+    Find the stored recommendation for a profile's bucket.
+
+    Returns:
+        tuple: (table key, bucket profile, stored text or None when missing or stale)
+    """
+    bucket = profile_bucket(form_data)
+    key = bucket_key(bucket, language)
+    return key, bucket, recommendation_table.get(key, CATALOG_VERSION)
+
+def save_recommendation(key, output):
+    recommendation_table.put(key, CATALOG_VERSION, output)
+
+def generate_recommendation(bucket, language="en"):
+    """Generate and store the recommendation for one profile bucket"""
+    output = recommendation_chain(bucket, language).invoke(recommendation_inputs(bucket, language)).content
+    save_recommendation(bucket_key(bucket, language), output)
+    return output
+
+def stream_recommendations(form_data, language="en"):
+    """Yield the recommendation text: the stored one at once, or as it is generated and stored"""
+    started = time.perf_counter()
+    key, bucket, stored = lookup_recommendation(form_data, language)
+    if stored is not None:
+        record_ttft(time.perf_counter() - started, "recommendation_table")
+        yield stored
+        return
+    parts = []
+    for token in stream_chain(recommendation_chain(bucket, language), recommendation_inputs(bucket, language), "recommendation_agent"):
+        parts.append(token)
+        yield token
+    save_recommendation(key, "".join(parts))
+
+def precompute_recommendations(languages=tuple(RECOMMENDATION_PROMPTS), force=False, concurrency=4):
+    """
+    Batch job: generate the recommendation for every profile bucket and language.
+
+    Buckets already stored for the current catalog version are skipped unless
+    force is set; rows from older catalog versions are deleted.
+    """
+    pending = [
+        (bucket, language)
+        for language in languages
+        for bucket in all_buckets()
+        if force or recommendation_table.get(bucket_key(bucket, language), CATALOG_VERSION) is None
+    ]
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="recommendations") as pool:
+        list(pool.map(lambda job: generate_recommendation(*job), pending))
+    pruned = recommendation_table.prune(CATALOG_VERSION)
+    summary = {"catalog_version": CATALOG_VERSION, "generated": len(pending), "pruned": pruned}
+    print(f"Recommendation table: {summary}")
+    return summary
+
+__all__ = ['stream_recommendations', 'recommendation_inputs', 'recommendation_chain', 'lookup_recommendation',
+           'save_recommendation', 'precompute_recommendations', 'CATALOG_VERSION']
+
+if __name__ == "__main__":
+    # Precompute every profile bucket: python recommendation_agent.py [--force]
+    precompute_recommendations(force="--force" in sys.argv[1:])
@@ -0,0 +1,123 @@
+import os
+import time
+import sqlite3
+import threading
+from itertools import product
+
+# Quick-form ages are bucketed on the product entry-age bands (0-15 children's
+# plans, 18-65 adult plans) and the usual life stages in between
+AGE_BUCKETS = [(18, 24), (25, 34), (35, 44), (45, 54), (55, 65), (66, 100)]
+# Number of children is bucketed as 0, 1, 2 or 3+
+MAX_CHILDREN_BUCKET = 3
+# Parents who leave the number of children at 0
+UNKNOWN_CHILDREN = "unknown"
+
+RECOMMENDATION_TABLE_PATH = os.getenv("RECOMMENDATION_TABLE_PATH", os.path.join("kb_cache", "recommendations.sqlite"))
+# Precomputed recommendations older than this many days are regenerated (0 = never expire)
+RECOMMENDATION_MAX_AGE_DAYS = float(os.getenv("RECOMMENDATION_MAX_AGE_DAYS", "30"))
+
+def age_bucket(age):
+    for low, high in AGE_BUCKETS:
+        if low <= age <= high:
+            return f"{low}-{high}"
+    low, high = AGE_BUCKETS[0][0], AGE_BUCKETS[-1][1]
+    return f"{low}-{AGE_BUCKETS[0][1]}" if age < low else f"{AGE_BUCKETS[-1][0]}-{high}"
+
+def children_bucket(has_children, num_children):
+    if has_children and num_children <= 0:
+        return UNKNOWN_CHILDREN
+    return f"{MAX_CHILDREN_BUCKET}+" if num_children >= MAX_CHILDREN_BUCKET else str(num_children)
+
+def profile_bucket(form_data):
+    """
+    Reduce a quick-form profile to its bucket.
+
+    The bucket has the same keys as the form data (age becomes a range such
+    as "35-44", num_children becomes "0".."3+", or "unknown" for a parent who
+    left the count at 0), so it can be used in place of the form data when
+    building the recommendation prompt.
+    """
+    has_children = bool(form_data["has_children"])
+    num_children = form_data["num_children"] if has_children else 0
+    return {
+        "age": age_bucket(form_data["age"]),
+        "is_married": bool(form_data["is_married"]),
+        "has_children": has_children,
+        "num_children": children_bucket(has_children, num_children),
+    }
+
+def all_buckets():
+    """Every profile bucket the quick form can produce"""
+    # (has_children, num_children) answers: none, 1..3+, and "yes" with the count left at 0
+    children = [(False, 0)] + [(True, n) for n in range(MAX_CHILDREN_BUCKET + 1)]
+    buckets = []
+    for (low, high), is_married, (has_children, num_children) in product(AGE_BUCKETS, (False, True), children):
+        buckets.append(profile_bucket({
+            "age": low, "is_married": is_married, "has_children": has_children, "num_children": num_children,
+        }))
+    return buckets
+
+def bucket_key(bucket, language):
+    married = "married" if bucket["is_married"] else "single"
+    return f"{language}:{bucket['age']}:{married}:{bucket['num_children']}"
+
+class RecommendationTable:
+    """
+    Precomputed recommendations per profile bucket and language, in SQLite.
+
+    Each row records the catalog version it was generated for; rows from
+    another version or older than max_age_days count as missing.
+    """
+
+    def __init__(self, path=RECOMMENDATION_TABLE_PATH, max_age_days=RECOMMENDATION_MAX_AGE_DAYS):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_age = max_age_days * 86400
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS recommendations "
+            "(key TEXT PRIMARY KEY, catalog_version TEXT, output TEXT, generated_at REAL)"
+        )
+        self._conn.commit()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0}
+
+    def get(self, key, catalog_version):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT catalog_version, output, generated_at FROM recommendations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            version, output, generated_at = row
+            if version != catalog_version or (self.max_age and time.time() - generated_at > self.max_age):
+                self.stats["stale"] += 1
+                return None
+            self.stats["hits"] += 1
+            return output
+
+    def put(self, key, catalog_version, output):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO recommendations (key, catalog_version, output, generated_at) VALUES (?, ?, ?, ?)",
+                (key, catalog_version, output, time.time()),
+            )
+            self._conn.commit()
+
+    def prune(self, catalog_version):
+        """Delete rows generated for other catalog versions"""
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM recommendations WHERE catalog_version != ?", (catalog_version,)
+            ).rowcount
+            self._conn.commit()
+            return deleted
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+__all__ = ['RecommendationTable', 'profile_bucket', 'all_buckets', 'bucket_key', 'AGE_BUCKETS']
@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+
+RESPONSE_DB = os.getenv("RESPONSE_DB", "insurance_responses.sqlite")
+# The writer commits up to this many responses per transaction, at least every flush interval
+RESPONSE_BATCH_SIZE = int(os.getenv("RESPONSE_BATCH_SIZE", "100"))
+RESPONSE_FLUSH_INTERVAL = float(os.getenv("RESPONSE_FLUSH_INTERVAL", "1.0"))
+RESPONSE_QUEUE_SIZE = int(os.getenv("RESPONSE_QUEUE_SIZE", "10000"))
+# A batch that fails to write (e.g. "database is locked") is retried this many times before it is dropped
+RESPONSE_WRITE_RETRIES = int(os.getenv("RESPONSE_WRITE_RETRIES", "5"))
+# At exit, queued responses get this many seconds to be written before the process stops waiting
+RESPONSE_EXIT_FLUSH_TIMEOUT = float(os.getenv("RESPONSE_EXIT_FLUSH_TIMEOUT", "10"))
+# Responses were appended to this JSONL log before the SQLite store; it is imported once and left in place
+RESPONSE_LEGACY_PATH = os.getenv("RESPONSE_LEGACY_PATH", "insurance_responses.json")
+# Downstream tools read completed questionnaires from this JSONL export
+RESPONSE_EXPORT_PATH = os.getenv("RESPONSE_EXPORT_PATH", "insurance_responses_export.jsonl")
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS responses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at REAL NOT NULL,
+        age INTEGER,
+        marital_status TEXT,
+        has_children TEXT,
+        income TEXT,
+        payment_preference TEXT,
+        insurance_needs TEXT,
+        health_concerns TEXT,
+        payload TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_responses_created_at ON responses (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_responses_age ON responses (age)",
+    "CREATE INDEX IF NOT EXISTS idx_responses_profile ON responses (marital_status, has_children, income)",
+    "CREATE TABLE IF NOT EXISTS imports (path TEXT PRIMARY KEY, imported_at REAL NOT NULL, count INTEGER NOT NULL)",
+]
+
+def connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    # WAL lets several worker processes write while readers export
+    conn.execute("PRAGMA journal_mode=WAL")
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+def response_row(responses, created_at):
+    return (
+        created_at,
+        responses.get("Age"),
+        responses.get("MaritalStatus"),
+        responses.get("HasChildren"),
+        responses.get("Income"),
+        responses.get("PaymentPreference"),
+        json.dumps(responses.get("InsuranceNeeds"), ensure_ascii=False),
+        json.dumps(responses.get("HealthConcerns"), ensure_ascii=False),
+        json.dumps(responses, ensure_ascii=False),
+    )
+
+def import_legacy(conn, path=RESPONSE_LEGACY_PATH):
+    """
+    Copy the legacy JSONL log into the responses table, once per database.
+
+    The log has no timestamps, so its responses get the file's modification
+    time and keep their file order. Unreadable lines are skipped.
+
+    Returns:
+        int: Number of responses imported (0 when already imported or missing)
+    """
+    if not os.path.exists(path):
+        return 0
+    key = os.path.abspath(path)
+    with conn:
+        if conn.execute("SELECT 1 FROM imports WHERE path = ?", (key,)).fetchone():
+            return 0
+        created_at = os.path.getmtime(path)
+        rows = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    responses = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(responses, dict):
+                    rows.append(response_row(responses, created_at))
+        conn.executemany(
+            "INSERT INTO responses (created_at, age, marital_status, has_children, income, "
+            "payment_preference, insurance_needs, health_concerns, payload) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.execute("INSERT INTO imports (path, imported_at, count) VALUES (?, ?, ?)", (key, time.time(), len(rows)))
+    print(f"Imported {len(rows)} responses from {path}")
+    return len(rows)
+
+class ResponseStore:
+    """
+    Questionnaire responses in SQLite, written off the request path.
+
+    save() only enqueues; a background thread drains the queue and inserts
+    whole batches per transaction, so concurrent sessions never block on or
+    interleave file writes.
+    """
+
+    def __init__(self, path=RESPONSE_DB, batch_size=RESPONSE_BATCH_SIZE, flush_interval=RESPONSE_FLUSH_INTERVAL):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=RESPONSE_QUEUE_SIZE)
+        self._conn = connect(path)
+        import_legacy(self._conn)
+        self.stats = {"queued": 0, "written": 0, "batches": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._run, name="response-writer", daemon=True)
+        self._writer.start()
+
+    def save(self, responses):
+        """Queue one completed questionnaire for writing"""
+        self._queue.put((responses, time.time()))
+        with self._stats_lock:
+            self.stats["queued"] += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                # Anything but a SQLite error (e.g. a malformed response) drops the batch, not the writer
+                with self._stats_lock:
+                    self.stats["errors"] += 1
+                print(f"Dropping {len(batch)} responses that could not be written: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        """Insert a batch in one transaction, retrying with backoff before giving up on it"""
+        rows = [response_row(responses, created_at) for responses, created_at in batch]
+        for attempt in range(RESPONSE_WRITE_RETRIES + 1):
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT INTO responses (created_at, age, marital_status, has_children, income, "
+                        "payment_preference, insurance_needs, health_concerns, payload) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        rows,
+                    )
+                with self._stats_lock:
+                    self.stats["written"] += len(batch)
+                    self.stats["batches"] += 1
+                return
+            except sqlite3.Error as e:
+                with self._stats_lock:
+                    self.stats["errors"] += 1
+                if attempt == RESPONSE_WRITE_RETRIES:
+                    print(f"Dropping {len(batch)} responses after {attempt + 1} failed writes: {str(e)}")
+                    return
+                print(f"Error writing {len(batch)} responses, retrying: {str(e)}")
+                time.sleep(min(30, 0.5 * 2 ** attempt))
+
+    def flush(self, timeout=None):
+        """
+        Block until every queued response has been written, or timeout seconds have passed.
+
+        Returns:
+            bool: True when the queue was drained
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    print(f"{self._queue.unfinished_tasks} responses still unwritten after {timeout}s")
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def export_jsonl(self, path=RESPONSE_EXPORT_PATH, since=None):
+        """
+        Write stored responses as one JSON object per line, oldest first.
+
+        Args:
+            path (str): Output file (overwritten; never the legacy log)
+            since (float | None): Only responses created at or after this Unix time
+
+        Returns:
+            int: Number of responses written
+        """
+        if os.path.abspath(path) == os.path.abspath(RESPONSE_LEGACY_PATH):
+            raise ValueError(f"{path} is the legacy response log; export to another file")
+        self.flush()
+        conn = connect(self.path)
+        try:
+            rows = conn.execute(
+                "SELECT payload FROM responses WHERE created_at >= ? ORDER BY created_at, id", (since or 0,)
+            )
+            count = 0
+            with open(path, "w", encoding="utf-8") as f:
+                for (payload,) in rows:
+                    f.write(payload + "\n")
+                    count += 1
+            return count
+        finally:
+            conn.close()
+
+    def get_stats(self):
+        with self._stats_lock:
+            return {**self.stats, "pending": self._queue.qsize()}
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_response_store():
+    """Process-wide response store; queued responses are flushed at exit"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResponseStore()
+            atexit.register(_store.flush, RESPONSE_EXIT_FLUSH_TIMEOUT)
+        return _store
+
+__all__ = ['ResponseStore', 'get_response_store', 'import_legacy', 'RESPONSE_DB']
+
+if __name__ == "__main__":
+    # Export for downstream tools: python response_store.py [output.jsonl]
+    count = get_response_store().export_jsonl(sys.argv[1] if len(sys.argv) > 1 else RESPONSE_EXPORT_PATH)
+    print(f"Exported {count} responses")
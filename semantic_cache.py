@@ -0,0 +1,94 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# A new query reuses a cached answer when its cosine similarity to a cached query is at least this
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+
+class SemanticCache:
+    """
+    Answer cache keyed by query embedding.
+
+    Entries are scoped by a namespace (e.g. the categories searched) and the
+    knowledge base version they were generated from, expire after ttl
+    seconds and are evicted least-recently-used beyond max_entries.
+    """
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, ttl=SEMANTIC_CACHE_TTL, max_entries=SEMANTIC_CACHE_SIZE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now):
+        expired = [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        self.stats["evictions"] += len(expired)
+
+    def get(self, vector, namespace, version):
+        """Return the cached answer for the closest matching query, or None"""
+        query = self._normalize(vector)
+        with self._lock:
+            self._expire(time.time())
+            candidates = [
+                (key, entry) for key, entry in self._entries.items()
+                if entry["namespace"] == namespace and entry["version"] == version
+            ]
+            if candidates:
+                scores = np.stack([entry["vector"] for _, entry in candidates]) @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key, entry = candidates[best]
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    print(f"Semantic cache hit ({namespace}, similarity {scores[best]:.3f})")
+                    return entry["answer"]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, vector, namespace, version, answer):
+        with self._lock:
+            self._entries[self._next_id] = {
+                "vector": self._normalize(vector),
+                "namespace": namespace,
+                "version": version,
+                "answer": answer,
+                "created": time.time(),
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, version=None):
+        """Drop every entry, or only the entries not generated from version"""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if version is None or entry["version"] != version]
+            for key in stale:
+                del self._entries[key]
+            self.stats["invalidations"] += 1
+
+    def get_stats(self):
+        with self._lock:
+            total = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "size": len(self._entries),
+                "hit_rate": self.stats["hits"] / total if total else 0.0,
+            }
+
+__all__ = ['SemanticCache']
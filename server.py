@@ -0,0 +1,275 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from dotenv import load_dotenv
+from graph import get_graph, thread_config, save_job_result, serve_async, submit_recommendations
+from needs_agent import validate_answers
+from booking_store import get_booking_store, SlotUnavailableError, BookingLimitError
+from recommendation_agent import recommendation_chain, recommendation_inputs, lookup_recommendation, save_recommendation, recommendation_table
+from streaming import STREAM_TAG, record_ttft, ttft_stats
+from product_agent import context_stats, response_cache, ab_report
+from job_queue import get_job_queue, QueueFullError
+
+load_dotenv()
+
+# Browser origins allowed to call the service (contact_form.js fetches /slots and /bookings), comma separated,
+# e.g. the Streamlit app's "https://chat.example.com"; unset, no cross-origin browser calls are allowed
+CORS_ORIGINS = [origin.strip() for origin in os.getenv("CORS_ORIGINS", "").split(",") if origin.strip()]
+# Threads for the loop's default executor. ainvoke/astream_events run the graph's sync nodes there
+# (each holds a thread for a whole LLM call), and so do the asyncio.to_thread SQLite calls; the
+# asyncio default of min(32, cpus + 4) would cap concurrent turns at a handful on small machines
+SERVER_THREADS = int(os.getenv("SERVER_THREADS", "64"))
+
+@asynccontextmanager
+async def lifespan(app):
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=SERVER_THREADS, thread_name_prefix="server")
+    loop.set_default_executor(executor)
+    # Async checkpointer, and state writes from job threads go through this loop
+    serve_async(loop)
+    get_graph()
+    yield
+    executor.shutdown(wait=False)
+
+app = FastAPI(title="MB Ageas AI Chatbot", lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=CORS_ORIGINS, allow_methods=["GET", "POST"], allow_headers=["Content-Type"])
+
+class ChatRequest(BaseModel):
+    message: str
+    thread_id: Optional[str] = None
+
+class NeedsForm(BaseModel):
+    thread_id: Optional[str] = None
+    age: int = Field(ge=18, le=100)
+    is_married: bool
+    has_children: bool
+    num_children: int = Field(default=0, ge=0, le=10)
+    phone: str = Field(pattern=r"^\d{10}$")
+    email: str = Field(pattern=r"^[^@\s]+@[^@\s]+$")
+    language: Literal["en", "vi"] = "en"
+
+    def form_data(self):
+        return {
+            "age": self.age,
+            "is_married": self.is_married,
+            "has_children": self.has_children,
+            "num_children": self.num_children if self.has_children else 0,
+            "phone": self.phone,
+            "email": self.email,
+        }
+
+class QuestionnaireAnswers(BaseModel):
+    """Every needs_agent.QUESTIONS answer in one request, keyed like the questions"""
+    thread_id: Optional[str] = None
+    Age: int
+    MaritalStatus: str
+    HasChildren: str
+    Income: str
+    PaymentPreference: str
+    InsuranceNeeds: List[str]
+    HealthConcerns: List[str]
+
+    def answers(self):
+        """Answers checked against the questionnaire schema (min/max, allowed options)"""
+        try:
+            return validate_answers(self.model_dump(exclude={"thread_id"}))
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+class BookingRequest(BaseModel):
+    date: str = Field(pattern=r"^\d{4}-\d{2}-\d{2}$")
+    time: str = Field(pattern=r"^\d{2}:\d{2}$")
+    phone: str = Field(pattern=r"^\d{10}$")
+    notes: str = ""
+    thread_id: Optional[str] = None
+
+def sse(event, data):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def chat_result(thread_id, state):
+    return {
+        "thread_id": thread_id,
+        "output": state.get("output", ""),
+        "decision": state.get("decision"),
+        "show_form": bool(state.get("show_form")),
+        "show_contact_form": bool(state.get("show_contact_form")),
+        "current_question": state.get("current_question"),
+        "progress": state.get("progress"),
+        # Set when the answer is still being generated; poll GET /jobs/{id} for it
+        "recommendation_job": state.get("recommendation_job"),
+    }
+
+async def save_recommendations(thread_id, form_data, language, output):
+    """Keep the profile (with its language) and answer in the conversation state for follow-up turns"""
+    await asyncio.to_thread(
+        save_job_result,
+        thread_id,
+        "(submitted the quick needs form)",
+        {"form_data": {**form_data, "language": language}, "output": output, "show_contact_form": True},
+    )
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    """Run one conversation turn and return the final answer"""
+    thread_id = request.thread_id or str(uuid.uuid4())
+    state = await get_graph().ainvoke({"input": request.message}, config=thread_config(thread_id))
+    return chat_result(thread_id, state)
+
+def graph_stream(inputs, thread_id):
+    """Run one graph invocation, streaming answer tokens as 'token' events and the result as 'done'"""
+    config = thread_config(thread_id)
+    graph = get_graph()
+
+    async def events():
+        started = time.perf_counter()
+        first_token = True
+        try:
+            async for event in graph.astream_events(inputs, config=config, version="v2"):
+                if event["event"] != "on_chat_model_stream" or STREAM_TAG not in event.get("tags", []):
+                    continue
+                token = event["data"]["chunk"].content
+                if not token:
+                    continue
+                if first_token:
+                    record_ttft(time.perf_counter() - started, "api")
+                    first_token = False
+                yield sse("token", {"token": token})
+            snapshot = await graph.aget_state(config)
+            yield sse("done", chat_result(thread_id, snapshot.values))
+        except Exception as e:
+            print(f"Error in chat stream: {str(e)}")
+            yield sse("error", {"thread_id": thread_id, "error": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Run one conversation turn, streaming answer tokens as 'token' events and the result as 'done'"""
+    return graph_stream({"input": request.message}, request.thread_id or str(uuid.uuid4()))
+
+@app.post("/needs/questionnaire")
+async def submit_questionnaire(submission: QuestionnaireAnswers):
+    """Submit the whole needs questionnaire in one request; the recommendations are generated as job recommendation_job"""
+    answers = submission.answers()
+    thread_id = submission.thread_id or str(uuid.uuid4())
+    state = await get_graph().ainvoke({"needs_answers": answers}, config=thread_config(thread_id))
+    return chat_result(thread_id, state)
+
+@app.post("/needs/questionnaire/stream")
+async def stream_questionnaire(submission: QuestionnaireAnswers):
+    """Submit the whole needs questionnaire in one request; the 'done' event names the recommendation_job to poll"""
+    answers = submission.answers()
+    return graph_stream({"needs_answers": answers}, submission.thread_id or str(uuid.uuid4()))
+
+@app.post("/needs")
+async def submit_needs(form: NeedsForm):
+    """Submit the quick needs form and return personalized recommendations"""
+    thread_id = form.thread_id or str(uuid.uuid4())
+    form_data = form.form_data()
+    # The recommendation table is synchronous SQLite; keep it off the event loop
+    key, bucket, output = await asyncio.to_thread(lookup_recommendation, form_data, form.language)
+    if output is None:
+        response = await recommendation_chain(bucket, form.language).ainvoke(recommendation_inputs(bucket, form.language))
+        output = response.content
+        await asyncio.to_thread(save_recommendation, key, output)
+    await save_recommendations(thread_id, form_data, form.language, output)
+    return {"thread_id": thread_id, "output": output, "show_contact_form": True}
+
+@app.post("/recommendations/jobs", status_code=202)
+async def submit_recommendation_job(form: NeedsForm):
+    """Start generating recommendations for a quick needs form; poll GET /jobs/{job_id} for progress and the result"""
+    thread_id = form.thread_id or str(uuid.uuid4())
+    try:
+        job = await asyncio.to_thread(submit_recommendations, thread_id, form.form_data(), form.language)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"thread_id": thread_id, "job_id": job.id}
+
+@app.post("/recommendations/stream")
+async def stream_recommendations(form: NeedsForm):
+    """Generate recommendations for a quick needs form, streaming tokens as 'token' events"""
+    thread_id = form.thread_id or str(uuid.uuid4())
+    form_data = form.form_data()
+
+    async def events():
+        started = time.perf_counter()
+        parts = []
+        try:
+            key, bucket, output = await asyncio.to_thread(lookup_recommendation, form_data, form.language)
+            if output is not None:
+                record_ttft(time.perf_counter() - started, "api_recommendation_table")
+                yield sse("token", {"token": output})
+            else:
+                async for chunk in recommendation_chain(bucket, form.language).astream(recommendation_inputs(bucket, form.language)):
+                    if not chunk.content:
+                        continue
+                    if not parts:
+                        record_ttft(time.perf_counter() - started, "api_recommendation")
+                    parts.append(chunk.content)
+                    yield sse("token", {"token": chunk.content})
+                output = "".join(parts)
+                await asyncio.to_thread(save_recommendation, key, output)
+            await save_recommendations(thread_id, form_data, form.language, output)
+            yield sse("done", {"thread_id": thread_id, "output": output, "show_contact_form": True})
+        except Exception as e:
+            print(f"Error in recommendation stream: {str(e)}")
+            yield sse("error", {"thread_id": thread_id, "error": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+# The booking handlers are plain functions so FastAPI runs them in its threadpool:
+# book() can wait up to BOOKING_BUSY_TIMEOUT on the SQLite write lock and must not block the event loop
+@app.get("/slots")
+def available_slots():
+    """Free consultation slots for the booking window, as {date: [times]}"""
+    return {"slots": get_booking_store().available_slots()}
+
+@app.post("/bookings", status_code=201)
+def create_booking(request: BookingRequest):
+    """Book a consultation slot; 409 when it was taken in the meantime, 429 when the phone or conversation has too many bookings"""
+    try:
+        booking_id = get_booking_store().book(
+            request.date, request.time, request.phone, request.notes, request.thread_id
+        )
+    except SlotUnavailableError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except BookingLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"booking_id": booking_id, "date": request.date, "time": request.time}
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Status, queue position, partial output and result of a background job"""
+    status = get_job_queue().status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return status
+
+@app.get("/stats")
+async def stats():
+    """Context assembly, answer cache, recommendation table, mode comparison, job queue and time-to-first-token statistics"""
+    return {
+        "context": context_stats.get_stats(),
+        "response_cache": response_cache.get_stats(),
+        "recommendation_table": recommendation_table.get_stats(),
+        "product_modes": ab_report(),
+        "jobs": get_job_queue().get_stats(),
+        "ttft": ttft_stats(),
+    }
+
+if __name__ == "__main__":
+    # Serve from one process: the in-memory checkpointer and the job queue are per process, so
+    # with several workers a turn or GET /jobs/{id} landing on another worker would lose its state.
+    # Multiple workers need GRAPH_CHECKPOINTER=sqlite and a job store shared between processes.
+    uvicorn.run(app, host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", "8000")))
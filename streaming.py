@@ -0,0 +1,97 @@
+import time
+import queue
+import threading
+from collections import deque
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Chat models created with streaming=True carry this tag; only their tokens reach the user
+STREAM_TAG = "stream"
+
+_ttft_lock = threading.Lock()
+_ttft_samples = deque(maxlen=1000)
+
+def record_ttft(seconds, source):
+    """Record a time-to-first-token sample"""
+    with _ttft_lock:
+        _ttft_samples.append(seconds)
+    print(f"Time to first token ({source}): {seconds:.2f}s")
+
+def ttft_stats():
+    """Summary of recent time-to-first-token samples, in seconds"""
+    with _ttft_lock:
+        samples = sorted(_ttft_samples)
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "p50": samples[len(samples) // 2],
+        "p90": samples[min(len(samples) - 1, int(len(samples) * 0.9))],
+        "max": samples[-1],
+    }
+
+class TokenStreamHandler(BaseCallbackHandler):
+    """Forward tokens from user-facing chat models to a queue and time the first one"""
+
+    def __init__(self, source="graph"):
+        self.tokens = queue.Queue()
+        self.source = source
+        self.started = time.perf_counter()
+        self.first_token_at = None
+
+    def on_llm_new_token(self, token, *, tags=None, **kwargs):
+        if not token or STREAM_TAG not in (tags or []):
+            return
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            record_ttft(self.first_token_at - self.started, self.source)
+        self.tokens.put(token)
+
+class GraphStream:
+    """
+    Iterate over the tokens a graph invocation streams; the final state is in .result afterwards.
+
+    The graph runs in a worker thread so the caller can render tokens as they arrive.
+    """
+
+    _done = object()
+
+    def __init__(self, graph, inputs, config=None, source="graph"):
+        self.handler = TokenStreamHandler(source)
+        self.result = None
+        self.error = None
+        config = dict(config or {})
+        config["callbacks"] = list(config.get("callbacks") or []) + [self.handler]
+        self._thread = threading.Thread(target=self._run, args=(graph, inputs, config), daemon=True)
+        self._thread.start()
+
+    def _run(self, graph, inputs, config):
+        try:
+            self.result = graph.invoke(inputs, config=config)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.handler.tokens.put(self._done)
+
+    def __iter__(self):
+        while True:
+            token = self.handler.tokens.get()
+            if token is self._done:
+                break
+            yield token
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+def stream_chain(chain, inputs, source):
+    """Yield text chunks from a prompt | chat model chain, recording time to first token"""
+    started = time.perf_counter()
+    first = True
+    for chunk in chain.stream(inputs):
+        if not chunk.content:
+            continue
+        if first:
+            record_ttft(time.perf_counter() - started, source)
+            first = False
+        yield chunk.content
+
+__all__ = ['GraphStream', 'TokenStreamHandler', 'stream_chain', 'record_ttft', 'ttft_stats', 'STREAM_TAG']
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules live at the repository root; the chat models only need a key to be constructed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
@@ -0,0 +1,39 @@
+import threading
+from datetime import datetime
+import pytest
+from booking_store import BookingStore, SlotUnavailableError, BookingLimitError
+
+NOW = datetime(2030, 1, 1, 8, 0)
+
+def test_concurrent_bookings_never_overbook(tmp_path):
+    store = BookingStore(str(tmp_path / "bookings.sqlite"), capacity=2, max_active=1)
+    results = []
+
+    def book(phone):
+        try:
+            results.append(store.book("2030-01-02", "10:00", phone, now=NOW))
+        except SlotUnavailableError:
+            results.append(None)
+
+    threads = [threading.Thread(target=book, args=(f"09000000{i:02d}",)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len([result for result in results if result is not None]) == 2
+    assert "10:00" not in store.available_slots(NOW).get("2030-01-02", [])
+
+def test_active_bookings_are_capped_per_phone_and_conversation(tmp_path):
+    store = BookingStore(str(tmp_path / "bookings.sqlite"), max_active=2)
+    store.book("2030-01-02", "09:00", "0900000001", thread_id="a", now=NOW)
+    store.book("2030-01-02", "09:30", "0900000001", thread_id="b", now=NOW)
+    with pytest.raises(BookingLimitError):
+        store.book("2030-01-02", "10:00", "0900000001", thread_id="c", now=NOW)
+
+    store.book("2030-01-02", "10:00", "0900000002", thread_id="a", now=NOW)
+    with pytest.raises(BookingLimitError):
+        store.book("2030-01-02", "10:30", "0900000003", thread_id="a", now=NOW)
+
+    # Past bookings no longer count
+    later = datetime(2030, 1, 3, 8, 0)
+    assert store.book("2030-01-04", "09:00", "0900000001", now=later)
@@ -0,0 +1,39 @@
+import sqlite3
+from langchain_core.embeddings import Embeddings
+from embedding_cache import CachedEmbeddings
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += len(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [float(len(text)), 1.0]
+
+def test_query_vectors_stay_in_a_bounded_memory_cache(tmp_path):
+    path = tmp_path / "embeddings.sqlite"
+    base = CountingEmbeddings()
+    cache = CachedEmbeddings(base, "test-model", str(path), query_cache_size=2)
+
+    cache.embed_query("a")
+    cache.embed_query("bb")
+    cache.embed_query("a")
+    assert base.calls == 2
+
+    cache.embed_query("ccc")  # evicts "bb", the least recently used
+    cache.embed_query("bb")
+    assert base.calls == 4
+    assert len(cache._queries) == 2
+    assert sqlite3.connect(path).execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] == 0
+
+def test_document_vectors_are_stored(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    base = CountingEmbeddings()
+    CachedEmbeddings(base, "test-model", path).embed_documents(["x", "y", "x"])
+    vectors = CachedEmbeddings(base, "test-model", path).embed_documents(["y", "x"])
+    assert base.calls == 2
+    assert vectors == [[1.0, 1.0], [1.0, 1.0]]
@@ -0,0 +1,45 @@
+import pytest
+from graph import create_graph, BoundedMemorySaver, MEMORY_NODE
+from needs_agent import NEEDS_FLOW
+
+@pytest.mark.parametrize("needs_mode", ["form", "questionnaire"])
+def test_graph_compiles_in_every_needs_mode(needs_mode):
+    graph = create_graph(checkpointer=BoundedMemorySaver(), needs_mode=needs_mode)
+    nodes = set(graph.get_graph().nodes)
+    assert {"router", NEEDS_FLOW, "needs_submission", MEMORY_NODE} <= nodes
+    assert ("needs_agent" in nodes) == (needs_mode == "form")
+
+def test_job_finishing_before_its_turn_keeps_its_result(monkeypatch):
+    import time
+    import graph
+    from job_queue import JobQueue
+
+    queue = JobQueue(workers=1)
+    monkeypatch.setattr(graph, "get_job_queue", lambda: queue)
+    monkeypatch.setattr(graph, "router", lambda state: {"decision": "recommendation_agent"})
+    monkeypatch.setattr(graph, "lookup_recommendation", lambda form_data, language: (None, None, None))
+    monkeypatch.setattr(graph, "stream_recommendations", lambda form_data, language: iter(["Plan A"]))
+    add_turn = graph.add_turn
+
+    def slow_add_turn(*args):
+        # The turn is still running when the job saves its result
+        time.sleep(0.5)
+        return add_turn(*args)
+
+    monkeypatch.setattr(graph, "add_turn", slow_add_turn)
+    compiled = create_graph(checkpointer=BoundedMemorySaver())
+    monkeypatch.setattr(graph, "_graph", compiled)
+    monkeypatch.setattr(graph, "_event_loop", None)
+    config = graph.thread_config("race")
+
+    state = compiled.invoke({"input": "recommend me a plan", "form_data": {"age": 30}}, config=config)
+    job_id = state["recommendation_job"]
+    assert state["output"] == graph.RECOMMENDATIONS_PENDING
+
+    deadline = time.monotonic() + 10
+    while not queue.get(job_id).finished and time.monotonic() < deadline:
+        time.sleep(0.05)
+    values = compiled.get_state(config).values
+    assert values["output"] == "Plan A"
+    assert values.get("recommendation_job") is None
+    assert values["memory"]["turns"][-1]["assistant"] == "Plan A"
@@ -0,0 +1,29 @@
+import pytest
+from plan_summaries import is_overview_query
+
+@pytest.mark.parametrize("query", [
+    "What plans do you have?",
+    "what insurance plans does MB Ageas offer",
+    "List all plans",
+    "show me your health products",
+    "Give me an overview of all the plans.",
+    "summary of your products",
+    "Có những gói nào?",
+    "bên bạn có các sản phẩm bảo hiểm nào",
+    "Liệt kê tất cả các gói bảo hiểm",
+    "tổng quan về các sản phẩm",
+])
+def test_listing_questions_are_overviews(query):
+    assert is_overview_query(query)
+
+@pytest.mark.parametrize("query", [
+    "what is the waiting period for all plans",
+    "do all health plans cover dental?",
+    "which of your products has the lowest premium",
+    "list the exclusions of the health plans",
+    "các gói có chi trả nội trú không",
+    "những sản phẩm nào có quyền lợi thai sản",
+    "tổng quan quyền lợi của gói sức khỏe",
+])
+def test_questions_naming_an_attribute_fall_through(query):
+    assert not is_overview_query(query)
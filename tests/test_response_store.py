@@ -0,0 +1,23 @@
+import threading
+from response_store import ResponseStore
+
+def test_writer_survives_a_response_it_cannot_write(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = ResponseStore(str(tmp_path / "responses.sqlite"), flush_interval=0.01)
+    store.save({"Age": 30, "InsuranceNeeds": object()})
+    assert store.flush(timeout=5)
+    store.save({"Age": 40, "InsuranceNeeds": ["health"]})
+    assert store.flush(timeout=5)
+    stats = store.get_stats()
+    assert stats["written"] == 1
+    assert stats["errors"] == 1
+
+def test_flush_gives_up_after_its_timeout(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = ResponseStore(str(tmp_path / "responses.sqlite"), flush_interval=0.01)
+    release = threading.Event()
+    monkeypatch.setattr(store, "_write", lambda batch: release.wait())
+    store.save({"Age": 30})
+    assert not store.flush(timeout=0.2)
+    release.set()
+    assert store.flush(timeout=5)
@@ -0,0 +1,48 @@
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+import product_agent
+
+class FixedEmbeddings(Embeddings):
+    def embed_documents(self, texts):
+        raise NotImplementedError
+
+    def embed_query(self, text):
+        raise NotImplementedError
+
+def build_index(monkeypatch, vectors, categories):
+    texts = [f"chunk {i}" for i in range(len(vectors))]
+    index = FAISS.from_embeddings(
+        list(zip(texts, [list(map(float, vector)) for vector in vectors])),
+        FixedEmbeddings(),
+        metadatas=[{"category": category} for category in categories],
+    )
+    monkeypatch.setattr(product_agent, "_knowledge_base", index)
+    monkeypatch.setattr(product_agent, "_knowledge_base_version", f"test-{len(vectors)}")
+    return index
+
+def test_category_search_is_not_crowded_out_by_other_categories(monkeypatch):
+    rng = np.random.default_rng(0)
+    query = np.array([1.0, 0.0, 0.0, 0.0])
+    # 500 "savings" chunks sit right next to the query, the few "child" chunks far away
+    near = query + rng.normal(scale=0.01, size=(500, 4))
+    far = -query + rng.normal(scale=0.1, size=(5, 4))
+    build_index(monkeypatch, np.vstack([near, far]), ["savings"] * 500 + ["child"] * 5)
+
+    docs = product_agent.search_chunks(list(query), ["child"], k=3)
+
+    assert len(docs) == 3
+    assert {doc.metadata["category"] for doc in docs} == {"child"}
+
+def test_unfiltered_search_returns_k_nearest_candidates(monkeypatch):
+    vectors = np.eye(4).repeat(5, axis=0)
+    build_index(monkeypatch, vectors, ["a"] * 10 + ["b"] * 10)
+
+    docs = product_agent.search_chunks([1.0, 0.0, 0.0, 0.0], k=4)
+
+    assert len(docs) == 4
+    assert all(doc.metadata["category"] == "a" for doc in docs[:1])
+
+def test_unknown_category_returns_nothing(monkeypatch):
+    build_index(monkeypatch, np.eye(4), ["a", "a", "b", "b"])
+    assert product_agent.search_chunks([1.0, 0.0, 0.0, 0.0], ["child"]) == []